@@ -0,0 +1,368 @@
+"""
+Benchmark del percorso di rendering dei plugin (render_cell,
+table_visible_columns, extra_body_script, ...).
+
+Genera un cassaforte.db sintetico con lo schema reale di data/cassaforte.db
+(sesso/persona/luogo/meta_*, trigger audit compresi) a 10k / 100k / 1M righe,
+poi avvia Datasette in-process con plugins/, templates/ e static/ del progetto
+e interroga le pagine tabellari con datasette.client.
+
+Per ogni pagina riporta latenza p50/p95 della richiesta e, per ogni plugin,
+tempo p50/p95 per richiesta e numero medio di query SQL.
+
+Uso:
+    python bench/bench_plugins.py                    # 10k e 100k righe
+    python bench/bench_plugins.py --rows 1000000 -n 30
+    python bench/bench_plugins.py --json bench_output.json
+
+Richiede datasette installato (pip install datasette).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGINS_DIR = os.path.join(ROOT, "plugins")
+STATS_FILE = os.path.join(PLUGINS_DIR, "neo_common", "stats.py")
+SOURCE_DB = os.path.join(ROOT, "data", "cassaforte.db")
+DB_NAME = "cassaforte"
+
+# Pagine misurate: (etichetta, path). {pid}/{lid} vengono sostituiti con ID esistenti.
+PAGES = [
+    ("sesso", "/cassaforte/sesso"),
+    ("sesso sort", "/cassaforte/sesso?_sort_desc=id"),
+    ("sesso page 2", "/cassaforte/sesso?_sort=id&_next=50"),
+    ("sesso partner", "/cassaforte/sesso?partner_id={pid}"),
+    ("sesso partner+luogo", "/cassaforte/sesso?partner_id={pid}&luogo_id={lid}"),
+    ("persona", "/cassaforte/persona"),
+    ("form /sesso", "/sesso"),
+]
+
+BOOL_COLS = (
+    "droghe_offerte", "overdose", "mia_iniz", "gli_piacque", "lui_succhia", "io_scopo",
+    "io_succhio", "lui_scopa", "bb", "record", "lube", "libido", "dom", "dolore",
+    "chiacchiere", "kink", "viene_sega",
+)
+
+
+# —— generazione DB sintetico ——
+
+def _schema(src):
+    """(DDL tabelle/indici/viste, DDL trigger) dal DB reale."""
+    objs = src.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY type = 'table' DESC, rowid"
+    ).fetchall()
+    ddl = [sql for typ, _, sql in objs if typ != "trigger"]
+    triggers = [sql for typ, _, sql in objs if typ == "trigger"]
+    return ddl, triggers
+
+
+def build_db(path: str, rows: int, seed: int = 42) -> None:
+    """Crea il DB sintetico; i trigger audit vengono creati dopo il caricamento."""
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed)
+    src = sqlite3.connect(SOURCE_DB)
+    ddl, triggers = _schema(src)
+    meta_tables = [
+        r[0] for r in src.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'meta\\_%' ESCAPE '\\'"
+        )
+    ]
+    src.close()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    for sql in ddl:
+        conn.execute(sql)
+
+    # registry/meta copiati tali e quali (servono a sesso_form e render_ui)
+    conn.execute("ATTACH DATABASE ? AS src", [SOURCE_DB])
+    for t in meta_tables:
+        conn.execute(f'INSERT INTO main."{t}" SELECT * FROM src."{t}"')
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+
+    n_persona = max(rows // 20, 10)
+    n_luogo = max(rows // 50, 10)
+    n_sesh = max(rows // 10, 10)
+    for t in ("interrotto", "dove_sborra", "come_viene", "orgia", "sex_cruising"):
+        conn.executemany(f'INSERT INTO "{t}" (id) VALUES (?)', [(i,) for i in range(1, 21)])
+    conn.executemany(
+        "INSERT INTO luogo (id, indirizzo, nome, lat, lon, quartiere) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (i, f"Gade {i}", f"Luogo {i}", 55.6 + rnd.random() * 0.15, 12.45 + rnd.random() * 0.2,
+             rnd.choice(("Nørrebro", "Vesterbro", "Østerbro", "Amager", None)))
+            for i in range(1, n_luogo + 1)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO persona (id, attivo, nome, cognome, nascita, luogo_id, catfish, parco, workflowy) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (i, rnd.randint(0, 1), f"Nome{i}", f"Cognome{i}", f"19{rnd.randint(60, 99)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}",
+             rnd.randint(1, n_luogo), rnd.randint(0, 1), 0, rnd.choice(("", None, f"note persona {i}")))
+            for i in range(1, n_persona + 1)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO sesh (id, inizio, fine, voto) VALUES (?, ?, ?, ?)",
+        [(i, "2024-01-01T20:00", "2024-01-02T04:00", rnd.randint(1, 10)) for i in range(1, n_sesh + 1)],
+    )
+
+    cols = ["inizio", "fine", "partner_id", "sesh_id", "luogo_id", "interrotto_id", "voto", "workflowy"]
+    cols += list(BOOL_COLS)
+    sql = f"INSERT INTO sesso ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+
+    def gen():
+        for i in range(rows):
+            day = 1 + i % 28
+            yield [
+                f"2024-{1 + i % 12:02d}-{day:02d}T21:{i % 60:02d}",
+                f"2024-{1 + i % 12:02d}-{day:02d}T23:{i % 60:02d}",
+                rnd.randint(1, n_persona),
+                rnd.randint(1, n_sesh) if rnd.random() < 0.3 else None,
+                rnd.randint(1, n_luogo),
+                rnd.randint(1, 20) if rnd.random() < 0.05 else None,
+                rnd.randint(1, 10) if rnd.random() < 0.7 else None,
+                f"testo libero {i}" if rnd.random() < 0.2 else None,
+            ] + [
+                # "overdose" e "record" restano sempre vuote: l'auto-hide ha qualcosa da nascondere
+                0 if c in ("overdose", "record") else int(rnd.random() < 0.3)
+                for c in BOOL_COLS
+            ]
+
+    conn.executemany(sql, gen())
+    for sql in triggers:
+        conn.execute(sql)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+# —— strumentazione ——
+
+class Probe:
+    """Tempo per hook di plugin e query SQL attribuite al modulo chiamante."""
+
+    def __init__(self):
+        self.hook_time = defaultdict(float)   # plugin -> secondi nella richiesta corrente
+        self.queries = defaultdict(int)       # modulo -> query nella richiesta corrente
+
+    def reset(self):
+        self.hook_time.clear()
+        self.queries.clear()
+
+    @staticmethod
+    def caller_module() -> str:
+        f = sys._getframe(2)
+        while f is not None:
+            fn = os.path.abspath(f.f_code.co_filename)
+            if fn == STATS_FILE:
+                # query passata dal proxy neo_common.stats.tracked(): il plugin
+                # è quello del proxy, non il primo frame sotto plugins/
+                plugin = getattr(f.f_locals.get("self"), "_plugin", None)
+                if plugin:
+                    return plugin
+            elif fn.startswith(PLUGINS_DIR + os.sep):
+                rel = os.path.relpath(fn, PLUGINS_DIR)
+                return os.path.splitext(rel)[0].replace(os.sep, ".")
+            f = f.f_back
+        return "datasette"
+
+    def patch_database(self):
+        from datasette.database import Database
+
+        original = Database.execute
+        probe = self
+
+        def execute(db_self, *args, **kwargs):
+            probe.queries[probe.caller_module()] += 1
+            return original(db_self, *args, **kwargs)
+
+        Database.execute = execute
+
+    def wrap_hooks(self, pm):
+        """Avvolge le hookimpl dei plugin di plugins/ con un timer (anche per i risultati awaitable)."""
+        probe = self
+
+        def timed_awaitable(name, aw):
+            async def run():
+                t0 = time.perf_counter()
+                try:
+                    return await aw
+                finally:
+                    probe.hook_time[name] += time.perf_counter() - t0
+            return run()
+
+        def wrap(name, fn):
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    res = fn(*args, **kwargs)
+                finally:
+                    probe.hook_time[name] += time.perf_counter() - t0
+                if inspect.isawaitable(res):
+                    return timed_awaitable(name, res)
+                if inspect.iscoroutinefunction(res):
+                    # hook che restituisce una funzione async (Datasette la chiama e fa await)
+                    return lambda: timed_awaitable(name, res())
+                if isinstance(res, list):
+                    return [timed_awaitable(name, r) if inspect.isawaitable(r) else r for r in res]
+                return res
+            return wrapper
+
+        for hook_name in dir(pm.hook):
+            hook = getattr(pm.hook, hook_name)
+            if hook_name.startswith("_") or not hasattr(hook, "get_hookimpls"):
+                continue
+            for impl in hook.get_hookimpls():
+                fn_file = getattr(impl.function, "__code__", None)
+                if fn_file is None or not fn_file.co_filename.startswith(PLUGINS_DIR):
+                    continue
+                name = os.path.splitext(os.path.basename(fn_file.co_filename))[0]
+                impl.function = wrap(name, impl.function)
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+async def run_pages(db_path: str, iterations: int, warmup: int):
+    from datasette.app import Datasette
+    from datasette.plugins import pm
+
+    probe = Probe()
+    probe.patch_database()
+
+    with open(os.path.join(ROOT, "metadata.json"), encoding="utf-8") as f:
+        metadata = json.load(f)
+    ds = Datasette(
+        [db_path],
+        plugins_dir=PLUGINS_DIR,
+        template_dir=os.path.join(ROOT, "templates"),
+        static_mounts=[
+            ("static", os.path.join(ROOT, "static")),
+            ("custom", os.path.join(ROOT, "static", "custom")),
+        ],
+        metadata=metadata,
+        settings={"default_page_size": 50, "max_returned_rows": 20000},
+    )
+    probe.wrap_hooks(pm)
+    await ds.invoke_startup()
+
+    conn = sqlite3.connect(db_path)
+    pid, lid = conn.execute(
+        "SELECT partner_id, luogo_id FROM sesso GROUP BY partner_id, luogo_id ORDER BY count(*) DESC LIMIT 1"
+    ).fetchone()
+    conn.close()
+
+    results = []
+    for label, path in PAGES:
+        path = path.format(pid=pid, lid=lid)
+        latencies, plugin_times, plugin_queries = [], defaultdict(list), defaultdict(list)
+        status = None
+        for i in range(warmup + iterations):
+            probe.reset()
+            t0 = time.perf_counter()
+            resp = await ds.client.get(path)
+            elapsed = time.perf_counter() - t0
+            status = resp.status_code
+            if i < warmup:
+                continue
+            latencies.append(elapsed)
+            for name in set(probe.hook_time) | set(probe.queries):
+                plugin_times[name].append(probe.hook_time.get(name, 0.0))
+                plugin_queries[name].append(probe.queries.get(name, 0))
+        results.append({
+            "page": label,
+            "path": path,
+            "status": status,
+            "p50_ms": pct(latencies, 50) * 1000,
+            "p95_ms": pct(latencies, 95) * 1000,
+            "plugins": {
+                name: {
+                    "p50_ms": pct(plugin_times[name], 50) * 1000,
+                    "p95_ms": pct(plugin_times[name], 95) * 1000,
+                    "queries": statistics.mean(plugin_queries[name]) if plugin_queries[name] else 0,
+                }
+                for name in sorted(plugin_times)
+            },
+        })
+    return results
+
+
+def print_report(rows: int, results) -> None:
+    print(f"\n=== {rows:,} righe in sesso ===")
+    for r in results:
+        print(f"{r['page']:<22} [{r['status']}]  p50 {r['p50_ms']:8.1f} ms   p95 {r['p95_ms']:8.1f} ms   {r['path']}")
+        for name, s in r["plugins"].items():
+            print(f"    {name:<30} p50 {s['p50_ms']:8.2f} ms   p95 {s['p95_ms']:8.2f} ms   query/req {s['queries']:5.1f}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000],
+                    help="dimensioni di sesso da misurare (es. 10000 100000 1000000)")
+    ap.add_argument("-n", "--iterations", type=int, default=20)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--workdir", default=os.path.join(ROOT, "bench", ".data"),
+                    help="dove salvare i DB generati (riusati se --reuse)")
+    ap.add_argument("--reuse", action="store_true", help="non rigenerare DB già presenti")
+    ap.add_argument("--json", help="scrive anche i risultati in JSON")
+    ap.add_argument("--run-db", help=argparse.SUPPRESS)  # uso interno: misura un solo DB, stampa JSON
+    args = ap.parse_args(argv)
+
+    if args.run_db:
+        results = asyncio.run(run_pages(args.run_db, args.iterations, args.warmup))
+        print(json.dumps(results))
+        return
+
+    report = {}
+    for rows in args.rows:
+        # Il nome file determina il nome del database in Datasette (/cassaforte/...)
+        db_dir = os.path.join(args.workdir, str(rows))
+        os.makedirs(db_dir, exist_ok=True)
+        db_path = os.path.join(db_dir, f"{DB_NAME}.db")
+        if not (args.reuse and os.path.exists(db_path)):
+            t0 = time.perf_counter()
+            build_db(db_path, rows)
+            print(f"[bench] generato {db_path} in {time.perf_counter() - t0:.1f}s")
+        # Un processo per dimensione: plugin e cache in neo_common partono da zero
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-db", db_path,
+             "-n", str(args.iterations), "--warmup", str(args.warmup)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(proc.returncode)
+        results = json.loads(proc.stdout.strip().splitlines()[-1])
+        print_report(rows, results)
+        report[str(rows)] = results
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
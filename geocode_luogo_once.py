@@ -1,38 +1,264 @@
-import time
+"""
+Geocodifica dei luoghi senza coordinate (luogo.lat / luogo.lon NULL).
+
+- cache persistente geocode_cache(address_normalized, lat, lon, provider, ts):
+  un indirizzo già cercato non viene richiesto di nuovo (anche i "nessun
+  risultato", salvati con lat/lon NULL; --retry-failed li riprova)
+- indirizzi deduplicati prima delle richieste: N luoghi con lo stesso
+  indirizzo = 1 richiesta
+- UPDATE raggruppati: una transazione ogni --batch indirizzi, insieme al
+  checkpoint (geocode_checkpoint), così un'interruzione riparte da lì
+- provider intercambiabili: "nominatim" (geopy, online), "gazetteer" (file
+  CSV locale address,lat,lon, per prove senza rete) o "modulo:Classe"
+- richieste in parallelo (--workers) con un limite di frequenza comune
+  (--min-delay secondi tra una richiesta e la successiva)
+
+Esempi:
+  python geocode_luogo_once.py                          # output.db, Nominatim
+  python geocode_luogo_once.py --db data/cassaforte.db
+  python geocode_luogo_once.py --provider gazetteer --gazetteer luoghi.csv --min-delay 0 --workers 4
+"""
+
+import argparse
+import csv
+import importlib
+import re
 import sqlite3
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 DB = "output.db"
+CITY = "Copenhagen"
+JOB = "luogo"
+
+
+# —— normalizzazione ——
+
+def normalize(address):
+    """Chiave della cache: minuscole, spazi compressi, niente punteggiatura ai bordi."""
+    a = re.sub(r"\s+", " ", (address or "").strip().lower())
+    a = re.sub(r"\s*,\s*", ", ", a)
+    return a.strip(" ,.;")
+
+
+# —— provider ——
+
+class NominatimProvider:
+    name = "nominatim"
+
+    def __init__(self, args):
+        from geopy.geocoders import Nominatim
+
+        self._geolocator = Nominatim(user_agent="datasette_luoghi_mappa")
+
+    def geocode(self, address):
+        """(lat, lon), None se nessun risultato; solleva eccezione sugli errori."""
+        loc = self._geolocator.geocode(address, addressdetails=False, timeout=10)
+        return (loc.latitude, loc.longitude) if loc else None
+
+
+class GazetteerProvider:
+    """File CSV locale con intestazione address,lat,lon (indirizzi completi di città)."""
+
+    name = "gazetteer"
+
+    def __init__(self, args):
+        if not args.gazetteer:
+            raise SystemExit("--gazetteer FILE è obbligatorio con --provider gazetteer")
+        self._index = {}
+        with open(args.gazetteer, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    self._index[normalize(row["address"])] = (float(row["lat"]), float(row["lon"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+    def geocode(self, address):
+        return self._index.get(normalize(address))
+
+
+PROVIDERS = {
+    "nominatim": NominatimProvider,
+    "gazetteer": GazetteerProvider,
+}
 
-conn = sqlite3.connect(DB)
-conn.row_factory = sqlite3.Row
-cur = conn.cursor()
 
-geolocator = Nominatim(user_agent="datasette_luoghi_mappa")
-geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1, swallow_exceptions=False)
+def load_provider(spec, args):
+    if spec in PROVIDERS:
+        return PROVIDERS[spec](args)
+    # "modulo:Classe": classe con __init__(args), .name e .geocode(address)
+    module, _, attr = spec.partition(":")
+    if not attr:
+        raise SystemExit(f"provider sconosciuto: {spec}")
+    return getattr(importlib.import_module(module), attr)(args)
 
-rows = cur.execute("""
-    SELECT id, indirizzo
-    FROM luogo
-    WHERE (lat IS NULL OR lon IS NULL)
-      AND indirizzo IS NOT NULL AND indirizzo <> ''
-""").fetchall()
 
-for r in rows:
-    full = f"{r['indirizzo']}, Copenhagen"
+class RateLimiter:
+    """Almeno min_delay secondi tra l'inizio di due richieste, anche tra thread diversi."""
+
+    def __init__(self, min_delay):
+        self.min_delay = min_delay
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.min_delay
+        if start > now:
+            time.sleep(start - now)
+
+
+# —— database ——
+
+def ensure_tables(conn):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_normalized TEXT PRIMARY KEY,
+            lat REAL,
+            lon REAL,
+            provider TEXT,
+            ts TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP)
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS geocode_checkpoint (
+            job TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            ts TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP)
+        )"""
+    )
+    conn.commit()
+
+
+def pending(conn, city, after_id):
+    """{indirizzo normalizzato: [id luogo]} in ordine di primo id, dopo il checkpoint."""
+    rows = conn.execute(
+        """SELECT id, indirizzo FROM luogo
+           WHERE (lat IS NULL OR lon IS NULL)
+             AND indirizzo IS NOT NULL AND indirizzo <> ''
+             AND id > ?
+           ORDER BY id""",
+        [after_id],
+    ).fetchall()
+    groups = {}
+    for rid, indirizzo in rows:
+        full = f"{indirizzo}, {city}" if city else indirizzo
+        groups.setdefault(normalize(full), []).append(rid)
+    return groups
+
+
+def cached(conn, keys):
+    out = {}
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        ph = ",".join("?" * len(chunk))
+        for key, lat, lon in conn.execute(
+            f"SELECT address_normalized, lat, lon FROM geocode_cache WHERE address_normalized IN ({ph})", chunk
+        ):
+            out[key] = (lat, lon) if lat is not None and lon is not None else None
+    return out
+
+
+def flush(conn, results, groups, provider_name, checkpoint_id):
+    """Una transazione: cache, UPDATE di tutti i luoghi con quell'indirizzo, checkpoint."""
+    with conn:
+        conn.executemany(
+            """INSERT INTO geocode_cache(address_normalized, lat, lon, provider, ts)
+               VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+               ON CONFLICT(address_normalized) DO UPDATE SET
+                 lat = excluded.lat, lon = excluded.lon, provider = excluded.provider, ts = excluded.ts""",
+            [(key, *(pos or (None, None)), provider_name) for key, pos, fresh in results if fresh],
+        )
+        conn.executemany(
+            "UPDATE luogo SET lat = ?, lon = ? WHERE id = ?",
+            [(pos[0], pos[1], rid) for key, pos, _ in results if pos for rid in groups[key]],
+        )
+        conn.execute(
+            """INSERT INTO geocode_checkpoint(job, last_id, ts) VALUES (?, ?, CURRENT_TIMESTAMP)
+               ON CONFLICT(job) DO UPDATE SET last_id = excluded.last_id, ts = excluded.ts""",
+            [JOB, checkpoint_id],
+        )
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Geocodifica i luoghi senza coordinate.")
+    ap.add_argument("--db", default=DB, help=f"file SQLite (default {DB})")
+    ap.add_argument("--city", default=CITY, help=f"aggiunta a ogni indirizzo (default {CITY}, '' per nessuna)")
+    ap.add_argument("--provider", default="nominatim", help="nominatim | gazetteer | modulo:Classe")
+    ap.add_argument("--gazetteer", help="CSV address,lat,lon per --provider gazetteer")
+    ap.add_argument("--batch", type=int, default=50, help="indirizzi per transazione (default 50)")
+    ap.add_argument("--workers", type=int, default=1, help="richieste in parallelo (default 1)")
+    ap.add_argument("--min-delay", type=float, default=1.0,
+                    help="secondi minimi tra due richieste (Nominatim: almeno 1)")
+    ap.add_argument("--retry-failed", action="store_true", help="riprova gli indirizzi senza risultato in cache")
+    ap.add_argument("--restart", action="store_true", help="ignora il checkpoint e riparte dall'inizio")
+    args = ap.parse_args(argv)
+
+    provider = load_provider(args.provider, args)
+    limiter = RateLimiter(max(args.min_delay, 0.0))
+
+    conn = sqlite3.connect(args.db)
+    ensure_tables(conn)
+    row = None if args.restart else conn.execute(
+        "SELECT last_id FROM geocode_checkpoint WHERE job = ?", [JOB]
+    ).fetchone()
+    after_id = row[0] if row else 0
+    if after_id:
+        print(f"Riprendo dal checkpoint: luogo.id > {after_id}")
+
+    groups = pending(conn, args.city, after_id)
+    hits = cached(conn, groups)
+    todo = [k for k in groups if k not in hits or (hits[k] is None and args.retry_failed)]
+    n_ids = sum(len(v) for v in groups.values())
+    print(f"{n_ids} luoghi, {len(groups)} indirizzi distinti, {len(groups) - len(todo)} già in cache")
+
+    def lookup(key):
+        limiter.wait()
+        try:
+            return key, provider.geocode(key), None
+        except Exception as e:
+            return key, None, e
+
+    # Gli indirizzi in cache si applicano subito, insieme al primo batch
+    results = [(k, hits[k], False) for k in groups if k not in todo]
+    ok = sum(1 for _, pos, _ in results if pos)
+    errors = 0
     try:
-        loc = geocode(full, addressdetails=False, timeout=10)
-        if loc:
-            cur.execute(
-                "UPDATE luogo SET lat=?, lon=? WHERE id=?",
-                (loc.latitude, loc.longitude, r["id"])
-            )
-            conn.commit()
-            print("OK:", r["id"], full, loc.latitude, loc.longitude)
-        else:
-            print("NO MATCH:", r["id"], full)
-    except Exception as e:
-        print("ERR:", r["id"], full, e)
-        time.sleep(2)  # un piccolo backoff
-conn.close()
+        with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+            for i in range(0, len(todo), args.batch):
+                chunk = todo[i:i + args.batch]
+                for key, pos, err in pool.map(lookup, chunk):
+                    if err is not None:
+                        errors += 1
+                        print("ERR:", key, err)
+                        continue  # non in cache: riprovato alla prossima esecuzione
+                    print("OK:" if pos else "NO MATCH:", key, *(pos or ()))
+                    ok += bool(pos)
+                    results.append((key, pos, True))
+                # checkpoint: primo id dell'ultimo indirizzo di questo batch,
+                # a meno che ci siano stati errori (da riprovare)
+                last = chunk[-1]
+                checkpoint = after_id if errors else max(after_id, groups[last][0])
+                flush(conn, results, groups, provider.name, checkpoint)
+                results = []
+        if results:
+            flush(conn, results, groups, provider.name, after_id)
+        if not errors:
+            with conn:
+                conn.execute("DELETE FROM geocode_checkpoint WHERE job = ?", [JOB])
+    except KeyboardInterrupt:
+        print("Interrotto: il prossimo avvio riparte dall'ultimo checkpoint.")
+    finally:
+        conn.close()
+
+    print(f"Fatto: {ok} indirizzi con coordinate, {errors} errori")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
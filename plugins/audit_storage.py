@@ -0,0 +1,151 @@
+# plugins/audit_storage.py
+# ------------------------------------------------------------
+# Gestione di audit_dml all'avvio (vedi neo_common/audit.py):
+#   - sempre: indici su (table_name, rowid) e ts
+#   - "mode": "diff"  -> trigger audit generati (tabelle auditate + registry):
+#                         l'UPDATE salva solo le colonne cambiate e salta gli
+#                         UPDATE senza modifiche; vengono rigenerati da soli
+#                         quando audit_schema registra un cambio (o cambia
+#                         lo schema), controllando ogni "watch_seconds"
+#   - "rollover": true -> i mesi chiusi vanno in <archive_dir>/audit_YYYY-MM.db
+#
+#   "plugins": {
+#     "audit_storage": {
+#       "mode": "diff",                 // "full" (default) = trigger invariati
+#       "rollover": true,
+#       "archive_dir": "data/audit_archive",   // default: accanto al .db
+#       "keep_months": 1,               // mesi tenuti nel db principale (corrente incluso)
+#       "watch_seconds": 30
+#     }
+#   }
+#
+# Da riga di comando:
+#   python plugins/audit_storage.py data/cassaforte.db [--diff] [--rollover] [--archive-dir DIR] [--keep-months N]
+# ------------------------------------------------------------
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common import audit  # noqa: E402
+
+PLUGIN = "audit_storage"
+
+
+def maintain(conn, diff: bool = False, do_rollover: bool = False, archive_dir=None, keep_months: int = 1) -> dict:
+    if not audit.has_audit(conn):
+        return {"audit_dml": False}
+    audit.ensure_indexes(conn)
+    out = {"audit_dml": True, "triggers": []}
+    if diff:
+        out["triggers"] = audit.install_triggers(conn)
+    # rollover gestisce da sé le transazioni: chiude prima quella degli indici/trigger
+    conn.commit()
+    if do_rollover:
+        out["rollover"] = audit.rollover(conn, archive_dir, keep_months)
+    return out
+
+
+try:
+    from datasette import hookimpl
+except ImportError:  # uso da riga di comando senza Datasette
+    hookimpl = None
+
+if hookimpl is not None:
+    from neo_common.stats import STATS, tracked  # noqa: E402
+
+    def _config(datasette) -> dict:
+        try:
+            conf = datasette.plugin_config(PLUGIN) or {}
+        except Exception:
+            conf = {}
+        return {
+            "diff": str(conf.get("mode", "full")).lower() == "diff",
+            "do_rollover": bool(conf.get("rollover")),
+            "archive_dir": conf.get("archive_dir") or None,
+            "keep_months": int(conf.get("keep_months", 1)),
+        }
+
+    def _watch_seconds(datasette) -> float:
+        try:
+            return float((datasette.plugin_config(PLUGIN) or {}).get("watch_seconds", 30))
+        except Exception:
+            return 30.0
+
+    def _rebuild(conn, marker):
+        # Rigenera solo se lo schema o audit_schema sono cambiati dall'ultimo controllo
+        current = audit.schema_marker(conn)
+        if current == marker:
+            return current, []
+        # COMMIT come in maintain(): l'INSERT in audit_schema apre una transazione
+        # che altrimenti resterebbe aperta (e con lei il lock sul database)
+        with conn:
+            changed = audit.install_triggers(conn)
+        return audit.schema_marker(conn), changed
+
+    async def _watch(name, db, interval):
+        marker = await db.execute_fn(audit.schema_marker)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await db.execute_fn(audit.schema_marker) == marker:
+                    continue
+                marker, changed = await db.execute_write_fn(lambda conn: _rebuild(conn, marker), block=True)
+                if changed:
+                    print("[audit_storage] trigger rigenerati su", name, ":", changed)
+            except Exception as e:
+                print("[audit_storage] watch ERROR:", name, e)
+
+    _WATCHERS = []
+
+    @hookimpl
+    def startup(datasette):
+        conf = _config(datasette)
+
+        async def inner():
+            report = {}
+            for name, db in datasette.databases.items():
+                if name == "_internal" or not getattr(db, "is_mutable", True):
+                    continue
+                db = tracked(PLUGIN, db)
+                try:
+                    report[name] = await db.execute_write_fn(lambda conn: maintain(conn, **conf), block=True)
+                    if conf["diff"] and report[name].get("audit_dml"):
+                        _WATCHERS.append(asyncio.ensure_future(_watch(name, db, _watch_seconds(datasette))))
+                except Exception as e:
+                    report[name] = {"error": str(e)}
+                    print("[audit_storage] ERROR:", name, e)
+            STATS.info(PLUGIN, report)
+
+        return inner
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Indici, trigger diff e archivi mensili per audit_dml.")
+    ap.add_argument("db", help="percorso del file SQLite")
+    ap.add_argument("--diff", action="store_true", help="rigenera i trigger audit (UPDATE in modalità diff)")
+    ap.add_argument("--rollover", action="store_true", help="sposta i mesi chiusi negli archivi")
+    ap.add_argument("--archive-dir", help="cartella degli archivi (default: audit_archive accanto al db)")
+    ap.add_argument("--keep-months", type=int, default=1, help="mesi tenuti nel db principale")
+    args = ap.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        out = maintain(conn, args.diff, args.rollover, args.archive_dir, args.keep_months)
+        conn.commit()
+    finally:
+        conn.close()
+    print(json.dumps(out, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,33 @@
+import os
+import sys
+
 from datasette import hookimpl
 
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common.rowset import (  # noqa: E402
+    COLSTATS_TABLE, getlist as _getlist, non_empty_sql as _non_empty_sql, rowset_summary,
+)
+from neo_common.stats import STATS, tracked  # noqa: E402
+
+PLUGIN = "auto_hide_empty_columns"
+
 # Colonne sempre visibili (aggiungi/togli come preferisci)
 ALWAYS_KEEP = {"id", "inizio", "fine"}
 
+# Tabella riassuntiva opzionale (plugin config "colstats": true):
+#   _colstats(table_name, column_name, non_empty_count)
+# mantenuta da trigger colstats__<table>__* creati accanto agli audit__<table>__*.
+# Senza filtri, l'auto-hide legge O(colonne) righe invece di aggregare la tabella
+# (la lettura sta in neo_common.rowset).
+
 def _qid(name: str) -> str:
     return '"' + name.replace('"', '""') + '"'
 
-def _getlist(qp, key: str):
-    if qp is None:
-        return []
-    getlist = getattr(qp, "getlist", None)
-    if callable(getlist):
-        try:
-            return list(getlist(key))
-        except Exception:
-            pass
-    get = getattr(qp, "get", None)
-    if callable(get):
-        v = get(key)
-        return [v] if v is not None else []
-    return []
+def _qlit(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
 
 def _split_csv(vals):
     out = []
@@ -32,61 +40,113 @@ def _split_csv(vals):
                 out.append(p)
     return out
 
-def _non_empty_sql(expr: str) -> str:
-    """
-    1 se NON vuoto, 0 altrimenti.
-    Vuoto se:
-      - NULL
-      - testo: solo spazi / NBSP / '&nbsp;'
-      - testo: '0','false','f','no','n' (case-insensitive)
-      - numerico: 0
-      - blob: len=0
+def _colstats_enabled(ds) -> bool:
+    try:
+        conf = ds.plugin_config(PLUGIN) or {}
+    except Exception:
+        return False
+    return bool(conf.get("colstats"))
+
+def _colstats_trigger_sql(table: str, cols) -> list:
     """
-    # NBSP = char(160)
-    trimmed = f"trim(replace(replace({expr}, char(160), ''), '&nbsp;', ''))"
-    lowered = f"lower({trimmed})"
-    return f"""
-    CASE
-      WHEN {expr} IS NULL THEN 0
-      WHEN typeof({expr}) = 'text' AND (
-        length({trimmed}) = 0 OR {lowered} IN ('0','false','f','no','n')
-      ) THEN 0
-      WHEN typeof({expr}) IN ('integer','real') AND {expr} = 0 THEN 0
-      WHEN typeof({expr}) = 'blob' AND length({expr}) = 0 THEN 0
-      ELSE 1
-    END
+    Trigger AFTER INSERT/UPDATE/DELETE che aggiornano _colstats con un solo UPDATE
+    per riga modificata (CASE sul nome colonna). Un'istruzione per elemento:
+    niente executescript, che farebbe COMMIT a metà della ricostruzione.
     """
+    def delta(fmt):
+        whens = "\n".join(
+            f"      WHEN {_qlit(c)} THEN {fmt(c)}" for c in cols
+        )
+        return (
+            f"  UPDATE {_qid(COLSTATS_TABLE)}\n"
+            f"  SET non_empty_count = non_empty_count + CASE column_name\n{whens}\n"
+            f"      ELSE 0 END\n"
+            f"  WHERE table_name = {_qlit(table)};\n"
+        )
+
+    new = lambda c: f"({_non_empty_sql('NEW.' + _qid(c))})"
+    old = lambda c: f"({_non_empty_sql('OLD.' + _qid(c))})"
+    out = []
+    for action, body in (
+        ("insert", delta(new)),
+        ("update", delta(lambda c: f"{new(c)} - {old(c)}")),
+        ("delete", delta(lambda c: f"-{old(c)}")),
+    ):
+        trg = _qid(f"colstats__{table}__{action}")
+        out.append(f"DROP TRIGGER IF EXISTS {trg}")
+        out.append(
+            f"CREATE TRIGGER {trg}\nAFTER {action.upper()} ON {_qid(table)}\nBEGIN\n{body}END"
+        )
+    return out
 
-def _build_where(qp, name_map):
+def _install_colstats(conn):
     """
-    WHERE dai parametri equality (col=val / col=val1&col=val2).
-    Se presente _where, lo include (pass-through: usalo solo se ti fidi della tua UI).
+    Crea _colstats e (ri)genera i trigger per ogni tabella che ha già i trigger
+    audit__<table>__*. I conteggi vengono ricostruiti (una scansione) solo se
+    l'elenco colonne salvato non coincide con quello attuale.
+    Tutto in un solo BEGIN/COMMIT: un crash a metà non lascia conteggi parziali
+    che poi verrebbero presi per buoni.
     """
-    if qp is None:
-        return "", []
-    clauses, params = [], []
-    keys = list(qp.keys()) if hasattr(qp, "keys") else []
-    for k in keys:
-        if not k or k.startswith("_"):
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    with conn:
+        return _rebuild_colstats(conn)
+
+def _rebuild_colstats(conn):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {_qid(COLSTATS_TABLE)} ("
+        " table_name TEXT NOT NULL,"
+        " column_name TEXT NOT NULL,"
+        " non_empty_count INTEGER NOT NULL DEFAULT 0,"
+        " PRIMARY KEY (table_name, column_name))"
+    )
+    tables = [
+        r[0] for r in conn.execute(
+            "SELECT DISTINCT tbl_name FROM sqlite_master"
+            " WHERE type = 'trigger' AND name LIKE 'audit\\_\\_%' ESCAPE '\\'"
+        )
+    ]
+    for table in tables:
+        cols = [r[1] for r in conn.execute(f"PRAGMA table_info({_qlit(table)})")]
+        if not cols:
             continue
-        lk = k.lower()
-        if lk not in name_map:
+        for stmt in _colstats_trigger_sql(table, cols):
+            conn.execute(stmt)
+        stored = {
+            r[0] for r in conn.execute(
+                f"SELECT column_name FROM {_qid(COLSTATS_TABLE)} WHERE table_name = ?",
+                [table],
+            )
+        }
+        if stored == set(cols):
             continue
-        vals = [v for v in _getlist(qp, k) if v is not None and str(v) != ""]
-        if not vals:
-            continue
-        col = _qid(name_map[lk])
-        if len(vals) == 1:
-            clauses.append(f"{col} = ?")
-            params.append(vals[0])
-        else:
-            ph = ",".join("?" for _ in vals)
-            clauses.append(f"{col} IN ({ph})")
-            params.extend(vals)
-    w = qp.get("_where") if hasattr(qp, "get") else None
-    if w:
-        clauses.append(f"({w})")
-    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+        sums = ", ".join(f"SUM({_non_empty_sql(_qid(c))})" for c in cols)
+        row = conn.execute(f"SELECT {sums} FROM {_qid(table)}").fetchone()
+        conn.execute(f"DELETE FROM {_qid(COLSTATS_TABLE)} WHERE table_name = ?", [table])
+        conn.executemany(
+            f"INSERT INTO {_qid(COLSTATS_TABLE)} (table_name, column_name, non_empty_count)"
+            " VALUES (?, ?, ?)",
+            [(table, c, int(n or 0)) for c, n in zip(cols, row)],
+        )
+        print("[auto_hide] colstats ricostruite per", table)
+    return tables
+
+@hookimpl
+def startup(datasette):
+    if not _colstats_enabled(datasette):
+        return None
+
+    async def inner():
+        for name, db in datasette.databases.items():
+            if name == "_internal" or not getattr(db, "is_mutable", True):
+                continue
+            try:
+                tables = await tracked(PLUGIN, db).execute_write_fn(_install_colstats, block=True)
+                print("[auto_hide] colstats attive su", name, ":", tables)
+            except Exception as e:
+                print("[auto_hide] colstats ERROR:", name, e)
+
+    return inner
 
 @hookimpl
 async def table_visible_columns(columns, table, database, request, datasette=None, **kwargs):
@@ -95,6 +155,10 @@ async def table_visible_columns(columns, table, database, request, datasette=Non
     nel risultato filtrato corrente. Rispetta _columns/_hide e supporta disattivazione
     con _auto_hide_empty=off.
     """
+    with STATS.hook(PLUGIN, "table_visible_columns"):
+        return await _table_visible_columns(columns, table, database, request, datasette)
+
+async def _table_visible_columns(columns, table, database, request, datasette):
     # Normalizza lista colonne
     names, by_name = [], {}
     for c in columns:
@@ -109,7 +173,6 @@ async def table_visible_columns(columns, table, database, request, datasette=Non
         return columns
     if database not in ds.databases or not table:
         return columns
-    db = ds.databases[database]
 
     qp = getattr(request, "args", None) or getattr(request, "query_params", None)
 
@@ -140,37 +203,17 @@ async def table_visible_columns(columns, table, database, request, datasette=Non
             sel = [n for n in sel if n.lower() not in hset]
         return [by_name[n] for n in sel]
 
-    # —— AUTO-HIDE —— (query unica)
-    name_map = {n.lower(): n for n in names}
-    where_sql, params = _build_where(qp, name_map)
-
-    select_fields = []
-    for n in names:
-        if n in ALWAYS_KEEP:
-            select_fields.append(f"1 AS {_qid('__keep__' + n)}")
-        else:
-            select_fields.append(f"MAX({_non_empty_sql(_qid(n))}) AS {_qid('__keep__' + n)}")
-    sql = f"SELECT {', '.join(select_fields)} FROM {_qid(table)} {where_sql}"
-
-    try:
-        res = await db.execute(sql, params)
-        row = res.first()
-        if row is None:
-            return columns  # niente righe → non cambiare nulla
-        keep = set()
-        for n in names:
-            try:
-                flag = int(row['__keep__' + n])
-            except Exception:
-                flag = 0
-            if flag == 1:
-                keep.add(n)
-        if not keep:
-            return columns  # safety
-        visible = [n for n in names if n in keep]
-    except Exception as e:
-        print("[auto_hide] ERROR:", e)
+    # —— AUTO-HIDE —— (riepilogo condiviso con fk_pretty_where: query unica, con cache)
+    summary = await rowset_summary(
+        ds, database, table, request, use_colstats=_colstats_enabled(ds), plugin=PLUGIN
+    )
+    if summary is None:
         return columns
+    flags = summary["non_empty"]
+    # colonne non note al riepilogo (es. calcolate da Datasette): restano visibili
+    visible = [n for n in names if n in ALWAYS_KEEP or flags.get(n, True)]
+    if not visible:
+        return columns  # safety
 
     # Applica eventuale _hide sopra
     hides = _split_csv(_getlist(qp, "_hide"))
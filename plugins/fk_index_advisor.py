@@ -0,0 +1,223 @@
+# plugins/fk_index_advisor.py
+# ------------------------------------------------------------
+# Indici mancanti sulle colonne FK.
+#
+# Per ogni tabella legge PRAGMA foreign_key_list (più le colonne *_id senza
+# FK dichiarata) e controlla se le colonne sono la parte iniziale di un
+# indice (o la rowid). Per quelle scoperte riporta il piano attuale di
+# "WHERE col = ?" (EXPLAIN QUERY PLAN) e, a richiesta, le righe della tabella
+# e la stima delle righe lette con l'indice (righe / valori distinti): sono
+# due count(*) sull'intera tabella per ogni FK scoperta.
+#
+#   GET  /-/fk-indexes               -> JSON con i suggerimenti per ogni database
+#   GET  /-/fk-indexes?database=X    -> solo il database X
+#   GET  /-/fk-indexes?counts=1      -> anche righe e valori distinti
+#   POST /-/fk-indexes (create=1 nel body) -> crea gli indici mancanti; serve il
+#        permesso "fk-index-create" (concesso all'attore root)
+#
+# Da riga di comando (stessa logica, senza Datasette in esecuzione):
+#   python plugins/fk_index_advisor.py data/cassaforte.db [--create]
+# ------------------------------------------------------------
+
+import json
+import os
+import sqlite3
+import sys
+from typing import Any, Dict, List
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+PLUGIN = "fk_index_advisor"
+
+
+def _qid(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _tables(conn) -> List[str]:
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' "
+        "AND sql NOT LIKE 'CREATE VIRTUAL%' ORDER BY name"
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def _index_prefixes(conn, table: str) -> List[List[str]]:
+    """Colonne (in ordine) di ogni indice della tabella, più la rowid se è un alias INTEGER PRIMARY KEY."""
+    out = []
+    for idx in conn.execute(f"PRAGMA index_list({_qid(table)})").fetchall():
+        cols = [r[2] for r in conn.execute(f"PRAGMA index_info({_qid(idx[1])})").fetchall()]
+        out.append(cols)
+    pk = [r for r in conn.execute(f"PRAGMA table_info({_qid(table)})").fetchall() if r[5]]
+    if len(pk) == 1 and (pk[0][2] or "").upper() == "INTEGER":
+        out.append([pk[0][1]])
+    return out
+
+
+def _covered(cols: List[str], prefixes: List[List[str]]) -> bool:
+    return any(len(p) >= len(cols) and set(p[:len(cols)]) == set(cols) for p in prefixes)
+
+
+def advise(conn, counts: bool = True) -> List[Dict[str, Any]]:
+    """Una voce per ogni FK senza indice utilizzabile (rows/distinct None se counts è False)."""
+    out = []
+    for table in _tables(conn):
+        fks: Dict[int, Dict[str, Any]] = {}
+        for r in conn.execute(f"PRAGMA foreign_key_list({_qid(table)})").fetchall():
+            # id, seq, table, from, to, on_update, on_delete, match
+            fk = fks.setdefault(r[0], {"references": r[2], "columns": [], "declared": True})
+            fk["columns"].append(r[3])
+        # Colonne *_id senza FK dichiarata (es. persona.luogo_id): filtri altrettanto comuni
+        in_fk = {c for fk in fks.values() for c in fk["columns"]}
+        for r in conn.execute(f"PRAGMA table_info({_qid(table)})").fetchall():
+            if r[1].lower().endswith("_id") and r[1] not in in_fk and not r[5]:
+                fks[-1 - r[0]] = {"references": None, "columns": [r[1]], "declared": False}
+        if not fks:
+            continue
+        prefixes = _index_prefixes(conn, table)
+        for fk in fks.values():
+            cols = fk["columns"]
+            if _covered(cols, prefixes):
+                continue
+            where = " AND ".join(f"{_qid(c)} = ?" for c in cols)
+            plan = " | ".join(
+                r[3] for r in conn.execute(
+                    f"EXPLAIN QUERY PLAN SELECT 1 FROM {_qid(table)} WHERE {where}", [None] * len(cols)
+                ).fetchall()
+            )
+            col_list = ", ".join(_qid(c) for c in cols)
+            rows = distinct = None
+            if counts:
+                rows, distinct = conn.execute(
+                    f"SELECT (SELECT count(*) FROM {_qid(table)}), "
+                    f"(SELECT count(*) FROM (SELECT DISTINCT {col_list} FROM {_qid(table)}))"
+                ).fetchone()
+            name = "idx_" + table + "_" + "_".join(cols)
+            out.append({
+                "table": table,
+                "columns": cols,
+                "references": fk["references"],
+                "declared": fk["declared"],
+                "plan": plan,
+                "full_scan": plan.startswith("SCAN"),
+                "rows": rows,
+                "distinct": distinct,
+                # righe lette per "col = ?": oggi tutta la tabella, con l'indice ~ righe per valore
+                "rows_per_lookup_with_index": round(rows / distinct, 1) if distinct else (None if rows is None else 0),
+                "index": name,
+                "sql": f"CREATE INDEX IF NOT EXISTS {_qid(name)} ON {_qid(table)}({col_list})",
+            })
+    return out
+
+
+def create(conn, advice=None) -> List[str]:
+    """Crea gli indici suggeriti (nella transazione del chiamante); ritorna i nomi creati."""
+    advice = advise(conn, counts=False) if advice is None else advice
+    for a in advice:
+        conn.execute(a["sql"])
+    if advice:
+        conn.execute("PRAGMA optimize")
+    return [a["index"] for a in advice]
+
+
+# —— Datasette ——
+
+try:
+    from datasette import hookimpl
+    from datasette.utils.asgi import Response
+except ImportError:  # uso da riga di comando senza Datasette
+    hookimpl = None
+
+if hookimpl is not None:
+    from neo_common.stats import STATS, tracked  # noqa: E402
+
+    CREATE_PERMISSION = "fk-index-create"
+
+    @hookimpl
+    def permission_allowed(actor, action):
+        # Come permissions-debug in Datasette: all'attore root, agli altri solo se
+        # un altro plugin lo concede
+        if action == CREATE_PERMISSION and actor and actor.get("id") == "root":
+            return True
+        return None
+
+    def _databases(datasette, request):
+        only = request.args.get("database")
+        for name, db in datasette.databases.items():
+            if name == "_internal" or (only and name != only):
+                continue
+            yield name, tracked(PLUGIN, db)
+
+    async def fk_indexes(request, datasette):
+        with STATS.hook(PLUGIN, "fk_indexes"):
+            do_create = False
+            if request.method == "POST":
+                form = await request.post_vars()
+                do_create = form.get("create") in ("1", "true", "on")
+                if do_create and not await datasette.permission_allowed(
+                    request.actor, CREATE_PERMISSION, default=False
+                ):
+                    return Response.json({"ok": False, "error": "Permission denied"}, status=403)
+            with_counts = request.args.get("counts") in ("1", "true", "on")
+
+            def check(conn):
+                return advise(conn, counts=with_counts)
+
+            out = {}
+            for name, db in _databases(datasette, request):
+                try:
+                    if do_create and getattr(db, "is_mutable", True):
+                        created = await db.execute_write_fn(create, block=True)
+                        out[name] = {"created": created, "missing": await db.execute_fn(check)}
+                    else:
+                        out[name] = {"missing": await db.execute_fn(check)}
+                except Exception as e:
+                    out[name] = {"error": str(e)}
+            return Response.json({"databases": out})
+
+    @hookimpl
+    def register_routes():
+        return [(r"^/-/fk-indexes$", fk_indexes)]
+
+
+# —— riga di comando ——
+
+def main(argv=None) -> int:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Suggerisce (e crea) gli indici mancanti sulle colonne FK.")
+    ap.add_argument("db", help="percorso del file SQLite")
+    ap.add_argument("--create", action="store_true", help="crea gli indici mancanti")
+    ap.add_argument("--json", action="store_true", help="output JSON")
+    args = ap.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        advice = advise(conn)
+        created = []
+        if args.create and advice:
+            with conn:
+                created = create(conn, advice)
+    finally:
+        conn.close()
+
+    if args.json:
+        print(json.dumps({"missing": advice, "created": created}, indent=2, ensure_ascii=False))
+        return 0
+    if not advice:
+        print("Nessun indice FK mancante.")
+    for a in advice:
+        print(
+            f"{a['table']}({', '.join(a['columns'])}) -> {a['references'] or '?'}: "
+            f"{a['rows']} righe, ~{a['rows_per_lookup_with_index']} per valore con indice  [{a['plan']}]"
+        )
+        print(f"    {a['sql']}")
+    if created:
+        print(f"Creati {len(created)} indici.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
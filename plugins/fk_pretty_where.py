@@ -6,9 +6,17 @@
 # Come funziona (server-side):
 # - Legge tutte le FK dallo schema SQLite (PRAGMA foreign_key_list)
 # - Integra eventuali FK e label_column presenti in metadata.json
-# - Per ogni parametro di query (es. ?indirizzo_id=4&partner_id=7)
-#   risolve gli ID nelle etichette reali eseguendo SELECT mirate
-# - Inietta il testo "umano" nel DOM con extra_body_script
+# - Per i parametri di query (es. ?indirizzo_id=4&partner_id=7)
+#   raggruppa gli ID per tabella padre e li risolve con una
+#   SELECT ... WHERE pk IN (...) per tabella, in parallelo,
+#   passando dalla cache condivisa neo_common.labels
+# - Il conteggio righe arriva da neo_common.rowset (stessa query di auto_hide)
+# - extra_body_script inserisce nella pagina un bundle JSON in
+#   window.FK_PRETTY_WHERE:
+#     {"database", "table", "count", "text",
+#      "filters": [{"column", "alias", "values", "labels": {id: label}}]}
+#   che static/pretty_where.js usa per riscrivere il riepilogo, senza
+#   nessuna richiesta di rete
 #
 # Limiti intenzionali:
 # - Gestisce i filtri standard (= e IN) della UI tabellare.
@@ -18,14 +26,30 @@
 from __future__ import annotations
 
 from datasette import hookimpl
-from datasette.utils import await_me_maybe
-from markupsafe import Markup
 from typing import Dict, Tuple, List, Any, Optional
+import asyncio
 import json
+import os
+import sys
 
-# Cache in memoria per evitare di ricostruire la mappa ad ogni richiesta
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common.labels import LABEL_CACHE  # noqa: E402
+from neo_common.rowset import getlist, rowset_summary, user_keys  # noqa: E402
+from neo_common.stats import STATS, tracked  # noqa: E402
+
+PLUGIN = "fk_pretty_where"
+
+# Cache in memoria per evitare di ricostruire la mappa ad ogni richiesta.
+# Sono versionate con PRAGMA schema_version: quando lo schema cambia si
+# confronta lo SQL delle tabelle in sqlite_master (più gli object_name nuovi
+# in audit_schema) e si rifà PRAGMA foreign_key_list solo per quelle cambiate.
 _FK_CACHE: Dict[str, Dict[Tuple[str, str], Tuple[str, str, str]]] = {}
 _PK_CACHE: Dict[Tuple[str, str], str] = {}  # (db, table) -> pk column name
+_FK_ROWS: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}  # (db, child) -> [(child_col, parent_table)]
+_SCHEMA_SEEN: Dict[str, Tuple[int, Dict[str, str], int]] = {}  # db -> (schema_version, {table: sql}, audit_schema.id)
 
 
 def _qident(name: str) -> str:
@@ -33,13 +57,18 @@ def _qident(name: str) -> str:
     return '"' + name.replace('"', '""') + '"'
 
 
+def _db(datasette, dbname: str):
+    """Database con le query conteggiate in /-/plugin-stats."""
+    return tracked(PLUGIN, datasette.databases[dbname])
+
+
 async def _get_pk(datasette, dbname: str, table: str) -> str:
     """Determina la primary key di 'table' (fallback: 'id')."""
     key = (dbname, table)
     if key in _PK_CACHE:
         return _PK_CACHE[key]
 
-    db = datasette.databases[dbname]
+    db = _db(datasette, dbname)
     safe_table = table.replace("'", "''")
     sql = f"PRAGMA table_info('{safe_table}')"
     res = await db.execute(sql)
@@ -66,28 +95,59 @@ async def _build_fk_map(datasette, dbname: str) -> Dict[Tuple[str, str], Tuple[s
     """
     Costruisce la mappa:
       (child_table, child_col) -> (parent_table, parent_pk_col, parent_label_col)
-    combinando PRAGMA + metadata.json
+    combinando PRAGMA + metadata.json.
+    Ricostruita solo se PRAGMA schema_version è cambiato, e in quel caso
+    rileggendo le FK delle sole tabelle modificate.
     """
-    if dbname in _FK_CACHE:
+    db = _db(datasette, dbname)
+
+    # 0) Schema invariato? -> mappa in cache
+    version = (await db.execute("PRAGMA schema_version")).first()[0]
+    seen = _SCHEMA_SEEN.get(dbname)
+    hit = dbname in _FK_CACHE and bool(seen) and seen[0] == version
+    STATS.cache("fk_map", hit)
+    if hit:
         return _FK_CACHE[dbname]
 
-    db = datasette.databases[dbname]
     fkmap: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
 
-    # 1) Elenco tabelle "reali"
+    # 1) Elenco tabelle "reali" con il loro SQL, per capire cosa è cambiato
     tables_res = await db.execute(
-        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
     )
-    tables = [r["name"] for r in tables_res.rows]
+    tables = {r["name"]: r["sql"] or "" for r in tables_res.rows}
+    old_tables = seen[1] if seen else {}
+    changed = {t for t in tables if old_tables.get(t) != tables[t]}
+    dropped = set(old_tables) - set(tables)
+
+    # Verifica incrociata con audit_schema (ALTER/ADD_TABLE registrati dal tool di schema)
+    last_audit = seen[2] if seen else 0
+    try:
+        res = await db.execute(
+            "SELECT id, object_name FROM audit_schema WHERE id > ? ORDER BY id", [last_audit]
+        )
+        for r in res.rows:
+            last_audit = r["id"]
+            if seen and r["object_name"] in tables:
+                changed.add(r["object_name"])
+    except Exception:
+        pass  # audit_schema non presente: basta il confronto su sqlite_master
+
+    for t in changed | dropped:
+        _PK_CACHE.pop((dbname, t), None)
+        _FK_ROWS.pop((dbname, t), None)
+    if seen:
+        print("[fk_pretty_where] schema cambiato:", sorted(changed | dropped))
 
-    # 2) PRAGMA foreign_key_list per ciascuna tabella figlia
+    # 2) PRAGMA foreign_key_list solo per le tabelle figlie nuove/cambiate
     for child_table in tables:
-        safe_child = child_table.replace("'", "''")
-        pragma_sql = f"PRAGMA foreign_key_list('{safe_child}')"
-        fks = await db.execute(pragma_sql)
-        for fk in fks.rows:
-            child_col = fk["from"]
-            parent_table = fk["table"]
+        key = (dbname, child_table)
+        if key not in _FK_ROWS:
+            safe_child = child_table.replace("'", "''")
+            pragma_sql = f"PRAGMA foreign_key_list('{safe_child}')"
+            fks = await db.execute(pragma_sql)
+            _FK_ROWS[key] = [(fk["from"], fk["table"]) for fk in fks.rows]
+        for child_col, parent_table in _FK_ROWS[key]:
             parent_pk = await _get_pk(datasette, dbname, parent_table)
             label_col = _label_col_from_metadata(datasette, dbname, parent_table) or parent_pk
             fkmap[(child_table, child_col)] = (parent_table, parent_pk, label_col)
@@ -110,6 +170,7 @@ async def _build_fk_map(datasette, dbname: str) -> Dict[Tuple[str, str], Tuple[s
                 fkmap[(child_table, child_col)] = (parent_table, parent_pk, label_col)
 
     _FK_CACHE[dbname] = fkmap
+    _SCHEMA_SEEN[dbname] = (version, tables, last_audit)
     return fkmap
 
 
@@ -120,133 +181,127 @@ def _alias_name(col: str) -> str:
     return col.replace("_", " ")
 
 
-async def _resolve_labels_for_param(
-    datasette, dbname: str, table: str, col: str, values: List[str], fkmap
-) -> str:
+async def _fetch_labels(
+    datasette, dbname: str, parent_table: str, parent_pk: str, parent_label: str, ids: List[str]
+) -> Dict[str, str]:
+    """ID -> label per una tabella padre: cache condivisa, poi una SELECT ... IN (...) per i mancanti."""
+    try:
+        db = _db(datasette, dbname)
+        return await LABEL_CACHE.labels(db, dbname, parent_table, parent_pk, parent_label, ids)
+    except Exception:
+        return {}  # fallback: restano gli ID grezzi
+
+
+async def _resolve_labels(
+    datasette, dbname: str, table: str, filters: List[Tuple[str, List[str]]], fkmap
+) -> List[Dict[str, str]]:
     """
-    Se 'col' è FK nota, risolve ciascun ID in label tramite SELECT;
-    altrimenti restituisce i valori grezzi.
+    Risolve in un colpo solo tutte le FK dei filtri della richiesta:
+    gli ID vengono raggruppati per tabella padre e ogni tabella viene
+    interrogata una volta sola (solo per gli ID non già in LABEL_CACHE);
+    le query per tabelle diverse partono in parallelo.
+    Ritorna, per ogni filtro, {id: label} dei soli ID risolti.
     """
-    key = (table, col)
-    if key not in fkmap:
-        return ", ".join(map(str, values))
-
-    parent_table, parent_pk, parent_label = fkmap[key]
-    db = datasette.databases[dbname]
-
-    labels: List[str] = []
-    for v in values:
-        try:
-            sql = (
-                f"SELECT {_qident(parent_label)} AS label "
-                f"FROM {_qident(parent_table)} WHERE {_qident(parent_pk)} = ? LIMIT 1"
-            )
-            row = (await db.execute(sql, [v])).first()
-            labels.append(str(row["label"]) if row and row["label"] is not None else str(v))
-        except Exception:
-            labels.append(str(v))
+    groups: Dict[Tuple[str, str, str], List[str]] = {}
+    for col, values in filters:
+        target = fkmap.get((table, col))
+        if target is None:
+            continue
+        ids = groups.setdefault(target, [])
+        for v in values:
+            if str(v) not in ids:
+                ids.append(str(v))
+
+    targets = list(groups)
+    if targets:
+        await LABEL_CACHE.refresh(_db(datasette, dbname), dbname)
+    results = await asyncio.gather(
+        *(_fetch_labels(datasette, dbname, *t, groups[t]) for t in targets)
+    )
+    by_target = dict(zip(targets, results))
 
-    return ", ".join(labels)
+    resolved: List[Dict[str, str]] = []
+    for col, values in filters:
+        labels = by_target.get(fkmap.get((table, col)), {})
+        resolved.append({str(v): labels[str(v)] for v in values if str(v) in labels})
+    return resolved
 
 
-async def _pretty_where_for_request(datasette, dbname: str, table: str, request) -> str:
-    """Costruisce la riga 'N rows where col = Label, ...' risolvendo tutte le FK note."""
+async def _bundle_for_request(datasette, dbname: str, table: str, request) -> Optional[Dict[str, Any]]:
+    """
+    Bundle per la riga 'N rows where col = Label, ...': conteggio, testo già
+    composto e, per ogni filtro, gli ID con le label risolte (tutte le FK note).
+    """
     qp = getattr(request, "args", None) or getattr(request, "query_params", None)
     if not qp:
-        return ""
+        return None
 
     fkmap = await _build_fk_map(datasette, dbname)
 
     # Raccogli i parametri 'user-facing' (esclusi quelli di servizio che iniziano con _)
-    parts: List[str] = []
-    keys = list(qp.keys()) if hasattr(qp, "keys") else []
-    user_keys = [k for k in keys if k and not k.startswith("_")]
-
-    # Conta righe (opzionale)
+    filters: List[Tuple[str, List[str]]] = []
+    for k in user_keys(qp):
+        vals = [v for v in getlist(qp, k) if v is not None and str(v) != ""]
+        if vals:
+            filters.append((k, vals))
+    if not filters:
+        return None
+
+    # Conta righe: dal riepilogo condiviso con auto_hide (stessa query, una volta
+    # per richiesta) in parallelo con la risoluzione delle label
+    summary, resolved = await asyncio.gather(
+        rowset_summary(datasette, dbname, table, request, plugin=PLUGIN),
+        _resolve_labels(datasette, dbname, table, filters, fkmap),
+    )
     n_rows: Optional[int] = None
-    try:
-        db = datasette.databases[dbname]
-        where_clauses: List[str] = []
-        params: List[Any] = []
-        for k in user_keys:
-            # supporta parametri ripetuti => IN (...)
-            if hasattr(qp, "getlist"):
-                vals = [v for v in qp.getlist(k) if v is not None and str(v) != ""]
-            else:
-                v = qp.get(k)
-                vals = [v] if v is not None and str(v) != "" else []
-            if not vals:
-                continue
-            if len(vals) == 1:
-                where_clauses.append(f"{_qident(k)} = ?")
-                params.append(vals[0])
-            else:
-                ph = ",".join("?" for _ in vals)
-                where_clauses.append(f"{_qident(k)} IN ({ph})")
-                params.extend(vals)
-
-        cnt_sql = f"SELECT count(*) AS n FROM {_qident(table)}"
-        if where_clauses:
-            cnt_sql += " WHERE " + " AND ".join(where_clauses)
-        row = (await db.execute(cnt_sql, params)).first()
-        if row:
-            n_rows = int(row["n"])
-    except Exception:
-        n_rows = None  # non è critico
-
-    # Costruisci "col = label" per ciascun parametro
-    for k in user_keys:
-        if hasattr(qp, "getlist"):
-            vals = [v for v in qp.getlist(k) if v is not None and str(v) != ""]
-        else:
-            v = qp.get(k)
-            vals = [v] if v is not None and str(v) != "" else []
-        if not vals:
-            continue
-
-        pretty_val = await _resolve_labels_for_param(datasette, dbname, table, k, vals, fkmap)
-        parts.append(f"{_alias_name(k)} = {pretty_val}")
+    if summary and summary["exact"] and summary["count"] is not None:
+        n_rows = summary["count"]
 
-    if not parts:
-        return ""
+    # "col = label" per ciascun parametro (label risolte in batch)
+    items: List[Dict[str, Any]] = []
+    parts: List[str] = []
+    for (k, values), labels in zip(filters, resolved):
+        alias = _alias_name(k)
+        items.append({"column": k, "alias": alias, "values": values, "labels": labels})
+        parts.append(f"{alias} = " + ", ".join(labels.get(str(v), str(v)) for v in values))
 
     prefix = f"{n_rows} row{'s' if n_rows != 1 else ''} where " if n_rows is not None else ""
-    return prefix + " and ".join(parts)
+    return {
+        "database": dbname,
+        "table": table,
+        "count": n_rows,
+        "text": prefix + " and ".join(parts),
+        "filters": items,
+    }
+
+
+def _json_for_script(data) -> str:
+    """JSON sicuro dentro <script>: niente "</script>" o "<!--" letterali."""
+    return (
+        json.dumps(data, ensure_ascii=False)
+        .replace("<", "\\u003c")
+        .replace(">", "\\u003e")
+        .replace("&", "\\u0026")
+    )
 
 
 @hookimpl
 def extra_body_script(datasette, database, table, view_name, request, **kwargs):
     """
-    Inietta uno script minimo che rimpiazza la riga standard "X row(s) where ..."
-    con la versione 'umana' calcolata server-side.
+    Pubblica il bundle con le label dei filtri FK della richiesta in
+    window.FK_PRETTY_WHERE; static/pretty_where.js lo legge e sostituisce la
+    riga standard "X row(s) where ..." con la versione 'umana' calcolata
+    server-side. Datasette fa await di build e ne mette il risultato dentro
+    <script>...</script>, quindi qui si restituisce solo JavaScript.
     """
     if not (database and table and request):
-        return []
+        return None
 
     async def build():
-        pretty = await _pretty_where_for_request(datasette, database, table, request)
-        if not pretty:
+        with STATS.hook(PLUGIN, "extra_body_script"):
+            bundle = await _bundle_for_request(datasette, database, table, request)
+        if not bundle:
             return ""
-        # Script piccolissimo che trova il nodo del riepilogo e lo sostituisce.
-        js = f"""
-        <script>
-        (function(){{
-          function findNode(){{
-            var root = document.querySelector('.content') || document;
-            var nodes = root.querySelectorAll('p, h2, h3, div, strong, span');
-            for (var i=0; i<nodes.length; i++) {{
-              var t = (nodes[i].textContent||'').trim().toLowerCase();
-              if (/^\\d+\\s+rows?\\s+where\\s+/.test(t)) {{
-                return nodes[i].closest('p,h2,h3,div') || nodes[i];
-              }}
-            }}
-            return null;
-          }}
-          var n = findNode();
-          if (n) n.textContent = {json.dumps(pretty)};
-        }})();
-        </script>
-        """
-        return Markup(js)
-
-    return [await_me_maybe(build())]
+        return f"window.FK_PRETTY_WHERE = {_json_for_script(bundle)};"
+
+    return build
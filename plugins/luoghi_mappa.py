@@ -1,56 +1,481 @@
-from datasette import hookimpl
-from datasette.utils.asgi import Response
+# plugins/luoghi_mappa.py
+# ------------------------------------------------------------
+# Mappa dei luoghi geocodificati (luogo.lat / luogo.lon).
+#
+#   /luoghi_mappa            -> pagina Leaflet, senza dati inline
+#   /luoghi_mappa.geojson    -> FeatureCollection in streaming
+#       ?bbox=ovest,sud,est,nord   solo i punti nel riquadro (L.LatLngBounds.toBBoxString())
+#       ?zoom=N                    coordinate arrotondate alla precisione utile a quello zoom
+#       ?cluster=1                 (con zoom) un punto per cella di griglia invece di un
+#                                  punto per luogo: poche centinaia di feature per schermo
+#       ?heat=1                    (con zoom) heatmap a celle: eventi per cella di griglia
+#
+# Il GeoJSON viene scritto una pagina alla volta (keyset su id, PAGE_SIZE
+# righe per query): memoria e tempo alla prima feature non crescono con il
+# numero di luoghi. ETag = versione dei dati (PRAGMA data_version) + parametri:
+# con If-None-Match uguale la risposta è un 304 senza query sui luoghi.
+#
+# Indice spaziale (opzionale, "rtree": true): all'avvio viene creata la R*Tree
+# _luogo_rtree(id, lat, lon) con i trigger luogo_rtree__insert/update/delete che
+# la tengono allineata a luogo; le query con bbox la usano al posto della
+# scansione della tabella. Senza l'opzione, o se SQLite non ha il modulo rtree,
+# le stesse query filtrano direttamente lat/lon.
+#
+# Clustering: celle quadrate di CLUSTER_PX pixel a quello zoom (in gradi:
+# 360 / 2^zoom * CLUSTER_PX / 256, in latitudine corrette con cos(lat) al centro
+# del bbox), GROUP BY cella in SQL. Ogni cella con più luoghi diventa una
+# feature {"cluster": true, "count": n} nel baricentro, con "bbox" per lo zoom;
+# una cella con un solo luogo resta il luogo stesso.
+#
+# Attività per luogo (opzionale, "stats": true): _luogo_stats(luogo_id, events,
+# last_date, voto_sum, voto_n) è tenuta aggiornata da trigger luogo_stats__sesso__insert/update/delete
+# sugli stessi eventi dei trigger audit di sesso, per differenza (+1/-1 e
+# somme), quindi la mappa non fa mai GROUP BY su sesso. Solo last_date, se si
+# cancella o sposta l'evento più recente, viene ricalcolata con una ricerca
+# sull'indice idx_sesso_luogo_id_inizio. Ogni feature ha events, last_date e
+# voto (media); i cluster e le celle della heatmap sommano events. Senza
+# _luogo_stats events vale 0, voto è null e heat=1 risponde 404.
+# Nota: i conteggi NON stanno dentro i trigger audit__sesso__* ma in trigger
+# propri sulla stessa tabella. I trigger audit sono generati da
+# neo_common/audit.py e ricreati da audit_storage a ogni cambio di schema, quindi
+# istruzioni aggiunte lì sparirebbero. È lo stesso schema già usato da _colstats
+# (auto_hide_empty_columns).
+#
+# Il database è il primo che contiene la tabella luogo, preferendo "output".
+#
+#   "plugins": { "luoghi_mappa": { "rtree": true, "stats": true } }
+# ------------------------------------------------------------
+
+import hashlib
 import json
+import math
+import os
+import sys
+
+from datasette import hookimpl
+from datasette.utils.asgi import AsgiStream, Response
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common.rowset import data_version_token  # noqa: E402
+from neo_common.stats import STATS, tracked  # noqa: E402
+
+PLUGIN = "luoghi_mappa"
+
+TABLE = "luogo"
+PREFERRED_DB = "output"
+RTREE = "_luogo_rtree"
+EVENTS = "sesso"
+STATS_TABLE = "_luogo_stats"
+PAGE_SIZE = 500
+MAX_ZOOM = 19
+CLUSTER_PX = 60
+HEAT_PX = 24
+MAX_CELLS = 2000
+
+_WHERE = """indirizzo IS NOT NULL AND indirizzo <> ''
+          AND lat IS NOT NULL AND lon IS NOT NULL"""
+
+
+def _qid(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _rtree_triggers():
+    t, r = _qid(TABLE), _qid(RTREE)
+    add = (f"INSERT OR REPLACE INTO {r}(id, min_lat, max_lat, min_lon, max_lon) "
+           f"SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon "
+           f"WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;")
+    return {
+        "insert": f"AFTER INSERT ON {t}\nBEGIN\n  {add}\nEND",
+        "update": (
+            f"AFTER UPDATE OF id, lat, lon ON {t}\n"
+            f"WHEN OLD.id IS NOT NEW.id OR OLD.lat IS NOT NEW.lat OR OLD.lon IS NOT NEW.lon\n"
+            f"BEGIN\n  DELETE FROM {r} WHERE id = OLD.id;\n  {add}\nEND"
+        ),
+        "delete": f"AFTER DELETE ON {t}\nBEGIN\n  DELETE FROM {r} WHERE id = OLD.id;\nEND",
+    }
+
+
+def _atomic(conn, fn):
+    """
+    fn(conn) in una sola transazione, con COMMIT alla fine: finché non c'è il
+    COMMIT le connessioni di lettura non vedono nulla, e senza il COMMIT la
+    connessione di scrittura terrebbe il lock sul database.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    with conn:
+        return fn(conn)
+
+
+def install_rtree(conn):
+    """
+    Crea (se serve) la R*Tree e i suoi trigger; la ricarica da luogo solo se
+    appena creata o se il numero di righe non torna. Ritorna un piccolo report.
+    """
+    return _atomic(conn, _install_rtree)
+
+
+def _install_rtree(conn):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [TABLE]).fetchone():
+        return {"skipped": f"no {TABLE} table"}
+    r = _qid(RTREE)
+    created = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", [RTREE]).fetchone()
+    if created:
+        conn.execute(f"CREATE VIRTUAL TABLE {r} USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    for action, body in _rtree_triggers().items():
+        name = f"luogo_rtree__{action}"
+        sql = f"CREATE TRIGGER {_qid(name)} {body}"
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", [name]).fetchone()
+        if row and row[0] == sql:
+            continue
+        conn.execute(f"DROP TRIGGER IF EXISTS {_qid(name)}")
+        conn.execute(sql)
+    expected = conn.execute(
+        f"SELECT count(*) FROM {_qid(TABLE)} WHERE lat IS NOT NULL AND lon IS NOT NULL"
+    ).fetchone()[0]
+    indexed = conn.execute(f"SELECT count(*) FROM {r}").fetchone()[0]
+    if created or indexed != expected:
+        conn.execute(f"DELETE FROM {r}")
+        conn.execute(
+            f"INSERT INTO {r}(id, min_lat, max_lat, min_lon, max_lon) "
+            f"SELECT id, lat, lat, lon, lon FROM {_qid(TABLE)} WHERE lat IS NOT NULL AND lon IS NOT NULL"
+        )
+        return {"rebuilt": expected}
+    return {"rows": indexed}
+
+
+def _stats_triggers():
+    e, st = _qid(EVENTS), _qid(STATS_TABLE)
+    add = (
+        f"INSERT INTO {st}(luogo_id, events, last_date, voto_sum, voto_n)\n"
+        f"  SELECT NEW.luogo_id, 1, NEW.inizio, coalesce(NEW.voto, 0), NEW.voto IS NOT NULL\n"
+        f"  WHERE NEW.luogo_id IS NOT NULL\n"
+        f"  ON CONFLICT(luogo_id) DO UPDATE SET\n"
+        f"    events = events + 1,\n"
+        f"    last_date = CASE WHEN last_date IS NULL OR excluded.last_date > last_date\n"
+        f"                     THEN coalesce(excluded.last_date, last_date) ELSE last_date END,\n"
+        f"    voto_sum = voto_sum + excluded.voto_sum,\n"
+        f"    voto_n = voto_n + excluded.voto_n;"
+    )
+    remove = (
+        f"UPDATE {st} SET\n"
+        f"    events = events - 1,\n"
+        f"    voto_sum = voto_sum - coalesce(OLD.voto, 0),\n"
+        f"    voto_n = voto_n - (OLD.voto IS NOT NULL),\n"
+        f"    last_date = CASE WHEN OLD.inizio >= last_date\n"
+        f"                     THEN (SELECT max(inizio) FROM {e} WHERE luogo_id = OLD.luogo_id)\n"
+        f"                     ELSE last_date END\n"
+        f"  WHERE luogo_id = OLD.luogo_id;\n"
+        f"  DELETE FROM {st} WHERE luogo_id = OLD.luogo_id AND events <= 0;"
+    )
+    return {
+        "insert": f"AFTER INSERT ON {e}\nBEGIN\n  {add}\nEND",
+        "update": (
+            f"AFTER UPDATE OF luogo_id, inizio, voto ON {e}\n"
+            f"WHEN OLD.luogo_id IS NOT NEW.luogo_id OR OLD.inizio IS NOT NEW.inizio OR OLD.voto IS NOT NEW.voto\n"
+            f"BEGIN\n  {remove}\n  {add}\nEND"
+        ),
+        "delete": f"AFTER DELETE ON {e}\nBEGIN\n  {remove}\nEND",
+    }
+
+
+def install_stats(conn):
+    """
+    Crea _luogo_stats, l'indice su sesso(luogo_id, inizio) e i trigger; rifà
+    i conteggi da zero solo se la tabella è nuova o i totali non tornano.
+    """
+    return _atomic(conn, _install_stats)
+
+
+def _install_stats(conn):
+    for t in (TABLE, EVENTS):
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [t]).fetchone():
+            return {"skipped": f"no {t} table"}
+    e, st = _qid(EVENTS), _qid(STATS_TABLE)
+    created = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", [STATS_TABLE]).fetchone()
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {st} (
+            luogo_id INTEGER PRIMARY KEY,
+            events INTEGER NOT NULL,
+            last_date TEXT,
+            voto_sum REAL NOT NULL DEFAULT 0,
+            voto_n INTEGER NOT NULL DEFAULT 0
+        )"""
+    )
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_sesso_luogo_id_inizio ON {e}(luogo_id, inizio)")
+    for action, body in _stats_triggers().items():
+        name = f"luogo_stats__{EVENTS}__{action}"
+        sql = f"CREATE TRIGGER {_qid(name)} {body}"
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", [name]).fetchone()
+        if row and row[0] == sql:
+            continue
+        conn.execute(f"DROP TRIGGER IF EXISTS {_qid(name)}")
+        conn.execute(sql)
+    expected = conn.execute(f"SELECT count(*) FROM {e} WHERE luogo_id IS NOT NULL").fetchone()[0]
+    counted = conn.execute(f"SELECT coalesce(sum(events), 0) FROM {st}").fetchone()[0]
+    if created or counted != expected:
+        conn.execute(f"DELETE FROM {st}")
+        conn.execute(
+            f"""INSERT INTO {st}(luogo_id, events, last_date, voto_sum, voto_n)
+            SELECT luogo_id, count(*), max(inizio), coalesce(sum(voto), 0), count(voto)
+            FROM {e} WHERE luogo_id IS NOT NULL GROUP BY luogo_id"""
+        )
+        return {"rebuilt": expected}
+    return {"events": counted}
+
 
 @hookimpl
-def register_routes():
-    return [(r"^/luoghi_mappa$", luoghi_mappa)]
+def startup(datasette):
+    try:
+        conf = datasette.plugin_config(PLUGIN) or {}
+    except Exception:
+        conf = {}
+    # Opt-in come colstats e matviews: senza config il database non viene toccato
+    installers = {}
+    if conf.get("rtree"):
+        installers["rtree"] = install_rtree
+    if conf.get("stats"):
+        installers["stats"] = install_stats
+    if not installers:
+        return None
+
+    async def inner():
+        report = {}
+        for name, db in datasette.databases.items():
+            if name == "_internal" or not getattr(db, "is_mutable", True):
+                continue
+            report[name] = {}
+            for key, fn in installers.items():
+                try:
+                    report[name][key] = await tracked(PLUGIN, db).execute_write_fn(fn, block=True)
+                except Exception as e:
+                    # es. SQLite compilato senza rtree: la mappa usa lat/lon direttamente
+                    report[name][key] = {"error": str(e)}
+                    print(f"[luoghi_mappa] {key} ERROR:", name, e)
+        STATS.info(PLUGIN, report)
+
+    return inner
+
+
+async def _choose_db(datasette):
+    names = [PREFERRED_DB] + [n for n in datasette.databases if n != PREFERRED_DB]
+    for name in names:
+        if name == "_internal" or name not in datasette.databases:
+            continue
+        db = datasette.get_database(name)
+        try:
+            if await db.table_exists(TABLE):
+                return name, tracked(PLUGIN, db)
+        except Exception:
+            continue
+    return None, None
+
 
-async def luoghi_mappa(scope, receive, datasette):
-    db = datasette.get_database("output")
-    rows = await db.execute("""
-        SELECT id, indirizzo, lat, lon
-        FROM luogo
-        WHERE indirizzo IS NOT NULL AND indirizzo <> ''
-          AND lat IS NOT NULL AND lon IS NOT NULL
-    """)
+def _parse_bbox(value):
+    """"ovest,sud,est,nord" -> (ovest, sud, est, nord); ValueError se non valido."""
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4 or not all(math.isfinite(p) for p in parts):
+        raise ValueError(value)
+    west, south, east, north = parts
+    if south > north:
+        raise ValueError(value)
+    return west, south, east, north
 
+
+def _bbox_sql(bbox, rtree):
+    """Condizione (con AND iniziale) e parametri per i luoghi nel bbox."""
+    if bbox is None:
+        return "", []
+    west, south, east, north = bbox
+    if west <= east:
+        where, params = " AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?", [south, north, west, east]
+        box = "max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?"
+    else:
+        # riquadro a cavallo dell'antimeridiano
+        where, params = " AND lat BETWEEN ? AND ? AND (lon >= ? OR lon <= ?)", [south, north, west, east]
+        box = "max_lat >= ? AND min_lat <= ? AND (max_lon >= ? OR min_lon <= ?)"
+    if rtree:
+        # la R*Tree (float a 32 bit, arrotondati verso l'esterno) restringe ai
+        # candidati; il filtro esatto su lat/lon resta
+        where = f" AND id IN (SELECT id FROM {_qid(RTREE)} WHERE {box})" + where
+        params = params + params
+    return where, params
+
+
+def _cells(bbox, zoom, px):
+    """Lato della cella in gradi (lon, lat), allargato se il bbox ne conterrebbe più di MAX_CELLS."""
+    cw = 360.0 / 2 ** zoom * px / 256
+    west, south, east, north = bbox or (-180.0, -85.0, 180.0, 85.0)
+    mid = math.radians(max(min((south + north) / 2, 85.0), -85.0))
+    ch = cw * math.cos(mid)
+    width = (east - west) % 360 or 360.0
+    n = (width / cw) * ((north - south) / ch)
+    if n > MAX_CELLS:
+        f = math.sqrt(n / MAX_CELLS)
+        cw, ch = cw * f, ch * f
+    return cw, ch
+
+
+def _decimals(zoom):
+    """Cifre decimali sufficienti a distinguere due pixel a quello zoom (tile 256px)."""
+    if zoom is None:
+        return None
+    return min(max(math.ceil(math.log10(256 * 2 ** zoom / 360)), 1), 7)
+
+
+def _etag(token, *params):
+    raw = json.dumps([list(token), *params], default=str)
+    return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def _stats_sql(has_stats):
+    """Colonne e JOIN dell'attività per luogo (NULL se _luogo_stats non c'è)."""
+    if not has_stats:
+        return "0 AS events, NULL AS last_date, 0 AS voto_sum, 0 AS voto_n", ""
+    return (
+        "coalesce(s.events, 0) AS events, s.last_date AS last_date, "
+        "coalesce(s.voto_sum, 0) AS voto_sum, coalesce(s.voto_n, 0) AS voto_n",
+        f" LEFT JOIN {_qid(STATS_TABLE)} s ON s.luogo_id = {TABLE}.id",
+    )
+
+
+def _voto(row):
+    return round(row["voto_sum"] / row["voto_n"], 2) if row["voto_n"] else None
+
+
+def _point(dbname, row, rnd):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [rnd(row["lon"]), rnd(row["lat"])]},
+        "properties": {
+            "id": row["id"],
+            "indirizzo": row["indirizzo"],
+            "url": f"/{dbname}/{TABLE}/{row['id']}",
+            "events": row["events"],
+            "last_date": row["last_date"],
+            "voto": _voto(row),
+        },
+    }
+
+
+def _error(message, status):
+    return Response.json({"ok": False, "error": message}, status=status)
+
+
+async def luoghi_geojson(request, datasette):
+    with STATS.hook(PLUGIN, "geojson"):
+        dbname, db = await _choose_db(datasette)
+        if db is None:
+            return _error(f"No database with a {TABLE} table", 404)
+        try:
+            bbox = _parse_bbox(request.args["bbox"]) if request.args.get("bbox") else None
+            zoom = request.args.get("zoom")
+            zoom = min(max(int(float(zoom)), 0), MAX_ZOOM) if zoom not in (None, "") else None
+        except ValueError:
+            return _error("bbox must be west,south,east,north and zoom a number", 400)
+        cluster = request.args.get("cluster") in ("1", "true", "on")
+        heat = request.args.get("heat") in ("1", "true", "on")
+        if (cluster or heat) and zoom is None:
+            return _error("cluster=1 and heat=1 need zoom", 400)
+
+        etag = _etag(await db.execute_fn(data_version_token), dbname, bbox, zoom, cluster, heat)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in (request.headers.get("if-none-match") or ""):
+            return Response("", status=304, headers=headers)
+
+        where, params = _bbox_sql(bbox, await db.table_exists(RTREE))
+        decimals = _decimals(zoom)
+
+        def rnd(v):
+            return round(v, decimals) if decimals is not None else v
+
+        cols, join = _stats_sql(await db.table_exists(STATS_TABLE))
+        if heat and not join:
+            return _error(f"No {STATS_TABLE} table (plugin config stats: true?)", 404)
+        if cluster or heat:
+            body = await _grid(db, dbname, bbox, zoom, heat, cols, join, where, params, rnd)
+            return Response(body, headers=headers, content_type="application/geo+json; charset=utf-8")
+
+        sql = f"""SELECT id, indirizzo, lat, lon, {cols} FROM {TABLE}{join}
+        WHERE {_WHERE}{where} AND id > ?
+        ORDER BY id LIMIT {PAGE_SIZE}"""
+
+        async def stream(r):
+            await r.write('{"type": "FeatureCollection", "features": [')
+            last_id, first = None, True
+            while True:
+                page = await db.execute(sql, params + [last_id if last_id is not None else -2 ** 63])
+                rows = page.rows
+                chunk = [json.dumps(_point(dbname, row, rnd), ensure_ascii=False) for row in rows]
+                if chunk:
+                    await r.write(("" if first else ",") + ",".join(chunk))
+                    first = False
+                if len(rows) < PAGE_SIZE:
+                    break
+                last_id = rows[-1]["id"]
+            await r.write("]}")
+
+        return AsgiStream(stream, headers=headers, content_type="application/geo+json; charset=utf-8")
+
+
+async def _grid(db, dbname, bbox, zoom, heat, cols, join, where, params, rnd):
+    """
+    Cluster (heat=False) o celle della heatmap (heat=True, solo luoghi con
+    eventi, bbox = la cella intera) come FeatureCollection serializzata.
+    """
+    cw, ch = _cells(bbox, zoom, HEAT_PX if heat else CLUSTER_PX)
+    # lon + 180 e lat + 90 sono >= 0: CAST AS INTEGER = floor
+    res = await db.execute(
+        f"""SELECT CAST((lon + 180) / ? AS INTEGER) AS gx, CAST((lat + 90) / ? AS INTEGER) AS gy,
+               count(*) AS n, avg(lat) AS lat, avg(lon) AS lon,
+               min(lat) AS south, max(lat) AS north, min(lon) AS west, max(lon) AS east,
+               min(id) AS id, min(indirizzo) AS indirizzo,
+               sum(events) AS events, max(last_date) AS last_date,
+               sum(voto_sum) AS voto_sum, sum(voto_n) AS voto_n
+        FROM (SELECT id, indirizzo, lat, lon, {cols} FROM {TABLE}{join}
+              WHERE {_WHERE}{where})
+        {"WHERE events > 0" if heat else ""}
+        GROUP BY gx, gy""",
+        [cw, ch] + params,
+    )
     features = []
-    for r in rows:
-        features.append({
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [r["lon"], r["lat"]]},
-            "properties": {
-                "id": r["id"],
-                "indirizzo": r["indirizzo"],
-                "url": f"/output/luogo/{r['id']}"
-            }
-        })
-
-    html = f"""
-    <!doctype html><html><head>
-      <meta charset="utf-8" />
-      <title>Mappa luoghi</title>
-      <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
-      <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
-      <style>#map{{height:100vh;width:100%}}</style>
-    </head><body>
-      <div id="map"></div>
-      <script>
-        const map = L.map('map').setView([55.6761,12.5683], 12);
-        L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
-          maxZoom: 19, attribution: '&copy; OpenStreetMap'
-        }}).addTo(map);
-
-        const data = {json.dumps({"type": "FeatureCollection", "features": features})};
-
-        L.geoJSON(data, {{
-          onEachFeature: (f, layer) => {{
-            const p = f.properties;
-            layer.bindPopup(`<strong>${{p.indirizzo}}</strong><br>
-              <a href="${{p.url}}" target="_blank">➡️ Apri in Datasette</a>`);
-          }}
-        }}).addTo(map);
-      </script>
-    </body></html>"""
-    return Response.html(html)
+    for row in res.rows:
+        if heat:
+            west, south = row["gx"] * cw - 180, row["gy"] * ch - 90
+            features.append({
+                "type": "Feature",
+                "bbox": [west, south, west + cw, south + ch],
+                "geometry": {"type": "Point", "coordinates": [rnd(west + cw / 2), rnd(south + ch / 2)]},
+                "properties": {"weight": row["events"], "count": row["n"], "voto": _voto(row)},
+            })
+        elif row["n"] == 1:
+            features.append(_point(dbname, row, rnd))
+        else:
+            features.append({
+                "type": "Feature",
+                "bbox": [row["west"], row["south"], row["east"], row["north"]],
+                "geometry": {"type": "Point", "coordinates": [rnd(row["lon"]), rnd(row["lat"])]},
+                "properties": {
+                    "cluster": True, "count": row["n"], "events": row["events"],
+                    "last_date": row["last_date"], "voto": _voto(row),
+                },
+            })
+    return json.dumps({"type": "FeatureCollection", "features": features}, ensure_ascii=False)
+
+
+async def luoghi_mappa(request, datasette):
+    with STATS.hook(PLUGIN, "page"):
+        html = await datasette.render_template("luoghi_mappa.html", {}, request=request)
+        return Response.html(html)
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/luoghi_mappa$", luoghi_mappa),
+        (r"^/luoghi_mappa\.geojson$", luoghi_geojson),
+    ]
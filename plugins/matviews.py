@@ -0,0 +1,301 @@
+# plugins/matviews.py
+# ------------------------------------------------------------
+# Viste *_v materializzate (opzionale).
+#
+# Una vista "semplice" (SELECT espressioni FROM "tabella", senza JOIN,
+# WHERE, GROUP BY, con "id" come prima colonna) viene sostituita da una
+# tabella vera con lo stesso nome, quindi gli URL non cambiano:
+#   - la definizione originale resta come vista _mv_src__<nome>
+#   - <nome> diventa una tabella (id INTEGER PRIMARY KEY, ...) con indici
+#     sulle colonne *_id e su quelle elencate in "index"
+#   - trigger mv__<nome>__insert/update/delete sulla tabella base
+#     aggiornano solo la riga toccata: INSERT OR REPLACE ... SELECT * FROM
+#     _mv_src__<nome> WHERE id = NEW.id (il filtro entra nella vista e usa la PK)
+# Le CASE WHEN x = 1 THEN '✅' vengono calcolate una volta per scrittura invece
+# che ad ogni lettura, e facet/auto-hide lavorano su una tabella normale.
+#
+#   "plugins": {
+#     "matviews": {
+#       "views": ["sex_v", "partner_v"],     // oppure "*" = tutte le *_v semplici
+#       "index": {"sex_v": ["inizio"]}       // indici extra (opzionale)
+#     }
+#   }
+#
+# Le viste tolte dall'elenco tornano viste normali all'avvio successivo.
+# Da riga di comando:
+#   python plugins/matviews.py data/cassaforte.db sex_v partner_v   ('*' per tutte, --drop per annullare)
+# ------------------------------------------------------------
+
+import json
+import os
+import re
+import sqlite3
+import sys
+from typing import Dict, List, Optional
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+PLUGIN = "matviews"
+
+SRC_PREFIX = "_mv_src__"
+STATE_TABLE = "_matviews"
+
+_VIEW_RE = re.compile(
+    r'^\s*CREATE\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:"[^"]+"|\[[^\]]+\]|`[^`]+`|\S+)\s+AS\s+(.*)$',
+    re.IGNORECASE | re.DOTALL,
+)
+_SIMPLE_RE = re.compile(
+    r'\bFROM\s+("([^"]+)"|\[([^\]]+)\]|`([^`]+)`|(\w+))\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL,
+)
+_NOT_SIMPLE = re.compile(r"\b(FROM|JOIN|WHERE|GROUP\s+BY|UNION|HAVING|LIMIT|DISTINCT)\b", re.IGNORECASE)
+# Stringhe '...' (saltate) e identificatori "..."; group(1) = "AS " davanti (alias)
+_QUOTED_RE = re.compile(r"""'(?:[^']|'')*'|(\bAS\s+)?"((?:[^"]|"")+)"(\s*\.)?""", re.IGNORECASE)
+
+
+def _qid(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _ensure_state(conn) -> None:
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            name TEXT PRIMARY KEY,
+            base TEXT NOT NULL,
+            select_sql TEXT NOT NULL,
+            ts TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP)
+        )"""
+    )
+
+
+def _state(conn) -> Dict[str, dict]:
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [STATE_TABLE]
+    ).fetchone():
+        return {}
+    return {
+        r[0]: {"base": r[1], "select_sql": r[2]}
+        for r in conn.execute(f"SELECT name, base, select_sql FROM {STATE_TABLE}").fetchall()
+    }
+
+
+def _object_type(conn, name: str) -> Optional[str]:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", [name]).fetchone()
+    return row[0] if row else None
+
+
+def _analyze(conn, name: str, select_sql: str) -> dict:
+    """Tabella base e colonne di una vista materializzabile, altrimenti {"error": ...}."""
+    head = select_sql.strip().rstrip(";")
+    m = _SIMPLE_RE.search(head)
+    if not m or _NOT_SIMPLE.search(head[:m.start()]):
+        return {"error": "not a single-table SELECT"}
+    base = next(g for g in m.groups()[1:] if g)
+    if _object_type(conn, base) != "table":
+        return {"error": f"base table {base} not found"}
+    base_info = conn.execute(f"PRAGMA table_info({_qid(base)})").fetchall()
+    base_pk = [r for r in base_info if r[5]]
+    if len(base_pk) != 1 or base_pk[0][1] != "id":
+        return {"error": f"{base} has no single 'id' primary key"}
+    # Un "x" che non è colonna della base SQLite lo legge come stringa 'x':
+    # la vista funziona ma dà una colonna costante. Meglio non materializzarla.
+    missing = _unknown_columns(head[:m.start()], {r[1].lower() for r in base_info})
+    if missing:
+        return {"error": f"columns not in {base}: {', '.join(missing)}"}
+    # Colonne della vista: la prima deve essere l'id della base
+    cur = conn.execute(f"SELECT * FROM ({head}) LIMIT 0")
+    cols = [d[0] for d in cur.description]
+    if not cols or cols[0] != "id":
+        return {"error": "first column is not id"}
+    return {"base": base, "columns": cols}
+
+
+def _unknown_columns(select_list: str, base_columns) -> List[str]:
+    """Identificatori "..." della select list che non sono colonne della base (alias esclusi)."""
+    out = []
+    for m in _QUOTED_RE.finditer(select_list):
+        if m.group(2) is None or m.group(1) or m.group(3):
+            continue
+        name = m.group(2).replace('""', '"')
+        if name.lower() not in base_columns and name not in out:
+            out.append(name)
+    return out
+
+
+def _column_types(conn, name: str) -> Dict[str, str]:
+    return {r[1]: r[2] or "" for r in conn.execute(f"PRAGMA table_info({_qid(name)})").fetchall()}
+
+
+def _materialize(conn, name: str, select_sql: str, extra_index: List[str]) -> dict:
+    info = _analyze(conn, name, select_sql)
+    if "error" in info:
+        return info
+    base, cols = info["base"], info["columns"]
+    src = SRC_PREFIX + name
+
+    conn.execute(f"DROP VIEW IF EXISTS {_qid(src)}")
+    conn.execute(f"CREATE VIEW {_qid(src)} AS {select_sql.strip().rstrip(';')}")
+    types = _column_types(conn, src)
+    if _object_type(conn, name) == "view":
+        conn.execute(f"DROP VIEW {_qid(name)}")
+    conn.execute(f"DROP TABLE IF EXISTS {_qid(name)}")
+    col_defs = ", ".join(
+        ["id INTEGER PRIMARY KEY"] + [f"{_qid(c)} {types.get(c, '')}".rstrip() for c in cols[1:]]
+    )
+    conn.execute(f"CREATE TABLE {_qid(name)} ({col_defs})")
+    conn.execute(f"INSERT INTO {_qid(name)} SELECT * FROM {_qid(src)}")
+
+    for c in cols[1:]:
+        if c.lower().endswith("_id") or c in extra_index:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {_qid(f'idx_{name}_{c}')} ON {_qid(name)}({_qid(c)})")
+
+    refresh = f"INSERT OR REPLACE INTO {_qid(name)} SELECT * FROM {_qid(src)} WHERE id = NEW.id;"
+    for action, body in (
+        ("insert", refresh),
+        ("update", f"DELETE FROM {_qid(name)} WHERE id = OLD.id AND OLD.id IS NOT NEW.id;\n  {refresh}"),
+        ("delete", f"DELETE FROM {_qid(name)} WHERE id = OLD.id;"),
+    ):
+        trg = f"mv__{name}__{action}"
+        conn.execute(f"DROP TRIGGER IF EXISTS {_qid(trg)}")
+        conn.execute(f"CREATE TRIGGER {_qid(trg)} AFTER {action.upper()} ON {_qid(base)}\nBEGIN\n  {body}\nEND")
+
+    _ensure_state(conn)
+    conn.execute(
+        f"INSERT OR REPLACE INTO {STATE_TABLE}(name, base, select_sql) VALUES (?, ?, ?)",
+        [name, base, select_sql.strip()],
+    )
+    return {"base": base, "rows": conn.execute(f"SELECT count(*) FROM {_qid(name)}").fetchone()[0]}
+
+
+def unmaterialize(conn, name: str) -> None:
+    """Ripristina la vista originale e toglie tabella, trigger e vista sorgente."""
+    st = _state(conn).get(name)
+    if not st:
+        return
+    for action in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {_qid(f'mv__{name}__{action}')}")
+    if _object_type(conn, name) == "table":
+        conn.execute(f"DROP TABLE {_qid(name)}")
+    conn.execute(f"DROP VIEW IF EXISTS {_qid(SRC_PREFIX + name)}")
+    conn.execute(f"CREATE VIEW {_qid(name)} AS {st['select_sql']}")
+    conn.execute(f"DELETE FROM {STATE_TABLE} WHERE name = ?", [name])
+
+
+def sync(conn, wanted, extra_index: Optional[Dict[str, List[str]]] = None) -> Dict[str, dict]:
+    """
+    Porta il database allo stato richiesto: wanted è un elenco di viste o "*"
+    (tutte le *_v semplici). Le viste già materializzate vengono ricostruite
+    solo se la definizione (la vista _mv_src__) è cambiata.
+    """
+    extra_index = extra_index or {}
+    state = _state(conn)
+    views = {
+        r[0]: r[1] for r in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'").fetchall()
+    }
+    if wanted == "*":
+        names = sorted(n for n in views if n.endswith("_v") and not n.startswith(SRC_PREFIX)) + sorted(state)
+    else:
+        names = list(wanted or [])
+    names = list(dict.fromkeys(names))
+
+    out: Dict[str, dict] = {}
+    for name in state:
+        if name not in names:
+            conn.execute("SAVEPOINT matview")
+            try:
+                unmaterialize(conn, name)
+                out[name] = {"restored": True}
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO matview")
+                out[name] = {"error": str(e)}
+            conn.execute("RELEASE matview")
+
+    for name in names:
+        if name in state:
+            # Definizione aggiornata a mano con CREATE VIEW _mv_src__<nome>?
+            src_sql = views.get(SRC_PREFIX + name)
+            m = _VIEW_RE.match(src_sql or "")
+            select_sql = m.group(1).strip() if m else state[name]["select_sql"]
+            if select_sql == state[name]["select_sql"] and _object_type(conn, name) == "table":
+                out[name] = {"base": state[name]["base"], "unchanged": True}
+                continue
+        elif name in views:
+            m = _VIEW_RE.match(views[name])
+            if not m:
+                out[name] = {"error": "cannot parse view SQL"}
+                continue
+            select_sql = m.group(1).strip()
+        else:
+            out[name] = {"error": "view not found"}
+            continue
+        # Ogni vista nel suo savepoint: un errore lascia la vista com'era
+        conn.execute("SAVEPOINT matview")
+        try:
+            res = _materialize(conn, name, select_sql, extra_index.get(name, []))
+        except sqlite3.Error as e:
+            res = {"error": str(e)}
+        if "error" in res:
+            conn.execute("ROLLBACK TO matview")
+        conn.execute("RELEASE matview")
+        out[name] = res
+    return out
+
+
+try:
+    from datasette import hookimpl
+except ImportError:  # uso da riga di comando senza Datasette
+    hookimpl = None
+
+if hookimpl is not None:
+    from neo_common.stats import STATS, tracked  # noqa: E402
+
+    @hookimpl
+    def startup(datasette):
+        try:
+            conf = datasette.plugin_config(PLUGIN) or {}
+        except Exception:
+            conf = {}
+        wanted = conf.get("views") or []
+        extra_index = conf.get("index") or {}
+
+        async def inner():
+            report = {}
+            for name, db in datasette.databases.items():
+                if name == "_internal" or not getattr(db, "is_mutable", True):
+                    continue
+                try:
+                    report[name] = await tracked(PLUGIN, db).execute_write_fn(
+                        lambda conn: sync(conn, wanted, extra_index), block=True
+                    )
+                except Exception as e:
+                    report[name] = {"error": str(e)}
+                    print("[matviews] ERROR:", name, e)
+            STATS.info(PLUGIN, report)
+
+        return inner
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Materializza le viste *_v semplici in tabelle aggiornate da trigger.")
+    ap.add_argument("db", help="percorso del file SQLite")
+    ap.add_argument("views", nargs="*", help="viste da materializzare ('*' = tutte le *_v)")
+    ap.add_argument("--drop", action="store_true", help="ripristina tutte le viste originali")
+    args = ap.parse_args(argv)
+
+    wanted = [] if args.drop else ("*" if args.views == ["*"] else args.views)
+    conn = sqlite3.connect(args.db)
+    try:
+        with conn:
+            out = sync(conn, wanted)
+    finally:
+        conn.close()
+    print(json.dumps(out, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+# plugins/neo_common
+# ------------------------------------------------------------
+# Codice condiviso fra i plugin in plugins/.
+#
+# Datasette carica ogni plugins/*.py come modulo isolato (non in sys.modules),
+# quindi i plugin non possono importarsi a vicenda. Questo package invece
+# viene importato normalmente (dopo aver aggiunto plugins/ a sys.path) ed è
+# quindi un singleton: cache e contatori qui dentro sono condivisi da tutti.
+# Datasette non lo registra come plugin perché non è un file .py di primo livello.
+# ------------------------------------------------------------
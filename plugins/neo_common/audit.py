@@ -0,0 +1,317 @@
+# plugins/neo_common/audit.py
+# ------------------------------------------------------------
+# Manutenzione di audit_dml (funzioni sincrone su una sqlite3.Connection,
+# da usare con db.execute_write_fn o da riga di comando).
+#
+# - ensure_indexes(): indici su (table_name, rowid) e su ts
+# - install_triggers(): genera i trigger audit__<alias>__insert/update/delete
+#   per le tabelle già auditate e per quelle in meta_registry_tables, con le
+#   colonne di PRAGMA table_info. L'UPDATE è in "modalità diff":
+#   old_values/new_values contengono solo le colonne cambiate
+#   (json_group_object su una UNION ALL delle colonne con OLD.c IS NOT NEW.c)
+#   e un WHEN salta gli UPDATE che non cambiano nulla. INSERT e DELETE
+#   restano snapshot completi, così la riga si ricostruisce applicando in
+#   ordine i dict (dict.update).
+# - rollover(): sposta i mesi chiusi in file separati
+#   <archive_dir>/audit_YYYY-MM.db (tabella audit_dml con gli stessi id),
+#   registrati in main.audit_archive. Prima copia (commit), poi cancella
+#   dal main solo gli id già presenti nell'archivio: con WAL i commit su
+#   database ATTACHati non sono atomici tra loro, così un'interruzione
+#   lascia al più un doppione, mai un buco.
+# ------------------------------------------------------------
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+AUDIT_TABLE = "audit_dml"
+ARCHIVE_TABLE = "audit_archive"
+
+_INDEXES = (
+    ("idx_audit_dml_table_rowid", "table_name, rowid"),
+    ("idx_audit_dml_ts", "ts"),
+)
+
+
+def _qid(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _qlit(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def has_audit(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [AUDIT_TABLE]
+    ).fetchone() is not None
+
+
+def ensure_indexes(conn, schema: str = "main") -> None:
+    for name, cols in _INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {_qid(schema)}.{_qid(name)} ON {AUDIT_TABLE}({cols})")
+
+
+# —— trigger ——
+
+def audit_triggers(conn) -> Dict[str, Dict[str, str]]:
+    """alias -> {"table": tabella vera, "insert"/"update"/"delete": nome trigger}."""
+    out: Dict[str, Dict[str, str]] = {}
+    rows = conn.execute(
+        "SELECT name, tbl_name FROM sqlite_master WHERE type = 'trigger' "
+        "AND name LIKE 'audit\\_\\_%' ESCAPE '\\'"
+    ).fetchall()
+    for name, tbl in rows:
+        parts = name.split("__")
+        if len(parts) != 3 or parts[2] not in ("insert", "update", "delete"):
+            continue
+        entry = out.setdefault(parts[1], {"table": tbl})
+        entry[parts[2]] = name
+    return out
+
+
+def _columns(conn, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({_qid(table)})").fetchall()]
+
+
+# Tabelle mai auditate: audit_* stesse, interne sqlite_* e di supporto _*
+_NO_AUDIT_PREFIXES = ("audit_", "sqlite_", "_")
+
+
+def _history_alias(conn, name: str, taken) -> str:
+    """
+    Alias per una tabella registrata senza trigger: se audit_dml ha già righe
+    con il nome senza "meta_" (es. meta_column_type -> column_type, scritto
+    dal vecchio tool di schema) si continua con quello, così la storia della
+    tabella non si spezza in due nomi.
+    """
+    if name.lower().startswith("meta_"):
+        old = name[len("meta_"):]
+        if old not in taken and conn.execute(
+            f"SELECT 1 FROM {AUDIT_TABLE} WHERE table_name = ? LIMIT 1", [old]
+        ).fetchone():
+            return old
+    return name
+
+
+def audited_tables(conn) -> Dict[str, str]:
+    """
+    tabella -> alias usato in audit_dml.table_name: le tabelle che hanno già
+    trigger audit__<alias>__* (alias invariato) più quelle registrate in
+    meta_registry_tables (alias storico se esiste, vedi _history_alias).
+    """
+    real = {
+        r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL%'"
+        ).fetchall()
+    }
+    out = {t["table"]: alias for alias, t in audit_triggers(conn).items() if t["table"] in real}
+    try:
+        registered = [r[0] for r in conn.execute("SELECT name FROM meta_registry_tables").fetchall()]
+    except Exception:
+        registered = []
+    for name in registered:
+        if name in real and name not in out and not name.lower().startswith(_NO_AUDIT_PREFIXES):
+            out[name] = _history_alias(conn, name, real | set(out.values()))
+    return out
+
+
+def trigger_sql(table: str, alias: str, cols: List[str]) -> Dict[str, str]:
+    """
+    SQL dei tre trigger. INSERT/DELETE: snapshot completo. UPDATE: solo le
+    colonne cambiate (json_group_object su UNION ALL), e il WHEN salta gli
+    UPDATE che non cambiano nulla.
+    """
+    def snapshot(ref):
+        return "json_object(" + ", ".join(f"{_qlit(c)}, {ref}.{_qid(c)}" for c in cols) + ")"
+
+    def full(action, ref, old, new):
+        return f"""CREATE TRIGGER {_qid(f"audit__{alias}__{action.lower()}")}
+AFTER {action} ON {_qid(table)}
+BEGIN
+  INSERT INTO {AUDIT_TABLE}(ts, action, table_name, rowid, old_values, new_values)
+  VALUES (
+    CURRENT_TIMESTAMP,
+    '{action}',
+    {_qlit(alias)},
+    {ref}.rowid,
+    {old},
+    {new}
+  );
+END"""
+
+    changed = "\n      UNION ALL ".join(
+        f"SELECT {_qlit(c)} AS k, OLD.{_qid(c)} AS o, NEW.{_qid(c)} AS n WHERE OLD.{_qid(c)} IS NOT NEW.{_qid(c)}"
+        for c in cols
+    )
+    guard = "\n   OR ".join(f"OLD.{_qid(c)} IS NOT NEW.{_qid(c)}" for c in cols)
+    update = f"""CREATE TRIGGER {_qid(f"audit__{alias}__update")}
+AFTER UPDATE ON {_qid(table)}
+WHEN {guard}
+BEGIN
+  INSERT INTO {AUDIT_TABLE}(ts, action, table_name, rowid, old_values, new_values)
+  SELECT CURRENT_TIMESTAMP, 'UPDATE', {_qlit(alias)}, NEW.rowid,
+         json_group_object(k, o), json_group_object(k, n)
+  FROM (
+      {changed}
+  );
+END"""
+    return {
+        "insert": full("INSERT", "NEW", "NULL", snapshot("NEW")),
+        "update": update,
+        "delete": full("DELETE", "OLD", snapshot("OLD"), "NULL"),
+    }
+
+
+def install_triggers(conn, tables: Optional[List[str]] = None) -> List[str]:
+    """
+    (Ri)crea i trigger audit delle tabelle (tutte quelle di audited_tables se
+    tables è None) con le colonne attuali di PRAGMA table_info. I trigger già
+    identici non vengono toccati; ogni tabella cambiata è registrata in
+    audit_schema. Ritorna le tabelle riscritte.
+    """
+    done = []
+    existing = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall())
+    log = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'audit_schema'"
+    ).fetchone() is not None
+    for table, alias in sorted(audited_tables(conn).items()):
+        if tables is not None and table not in tables:
+            continue
+        cols = _columns(conn, table)
+        if not cols:
+            continue
+        changed = False
+        for action, sql in trigger_sql(table, alias, cols).items():
+            name = f"audit__{alias}__{action}"
+            if existing.get(name) == sql:
+                continue
+            conn.execute(f"DROP TRIGGER IF EXISTS {_qid(name)}")
+            conn.execute(sql)
+            changed = True
+        if changed:
+            done.append(table)
+            if log:
+                conn.execute(
+                    "INSERT INTO audit_schema(action, object_type, object_name, details) VALUES (?, ?, ?, json(?))",
+                    ["APPLY_AUDIT_TRIGGERS", "table", table,
+                     json.dumps({"generator": "audit_storage", "alias": alias, "columns": cols})],
+                )
+    return done
+
+
+def schema_marker(conn) -> Tuple[int, int]:
+    """(schema_version, max(audit_schema.id)): cambia quando va rigenerato qualcosa."""
+    sv = conn.execute("PRAGMA schema_version").fetchone()[0]
+    try:
+        last = conn.execute("SELECT max(id) FROM audit_schema").fetchone()[0] or 0
+    except Exception:
+        last = 0
+    return sv, last
+
+
+# —— archivi mensili ——
+
+def _main_path(conn) -> str:
+    for _, name, path in conn.execute("PRAGMA database_list").fetchall():
+        if name == "main":
+            return path or ""
+    return ""
+
+
+def default_archive_dir(conn) -> str:
+    return os.path.join(os.path.dirname(_main_path(conn)) or ".", "audit_archive")
+
+
+def archive_path(archive_dir: str, month: str) -> str:
+    return os.path.join(archive_dir, f"audit_{month}.db")
+
+
+def _ensure_archive_table(conn) -> None:
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            ts TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP)
+        )"""
+    )
+
+
+def archives(conn) -> List[Tuple[str, str]]:
+    """[(mese, percorso)] degli archivi registrati, dal più vecchio."""
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [ARCHIVE_TABLE]
+    ).fetchone():
+        return []
+    return [tuple(r) for r in conn.execute(f"SELECT month, path FROM {ARCHIVE_TABLE} ORDER BY month").fetchall()]
+
+
+def rollover(conn, archive_dir: Optional[str] = None, keep_months: int = 1) -> Dict[str, int]:
+    """
+    Sposta negli archivi i mesi precedenti agli ultimi keep_months (mese
+    corrente incluso). Gestisce da sé le transazioni (ATTACH/DETACH non
+    sono ammessi dentro una transazione). Ritorna {mese: righe spostate}.
+    """
+    if not has_audit(conn):
+        return {}
+    if conn.in_transaction:
+        conn.commit()
+    archive_dir = archive_dir or default_archive_dir(conn)
+    cutoff = conn.execute(
+        "SELECT strftime('%Y-%m-%d', 'now', 'start of month', ?)", [f"-{max(keep_months, 1) - 1} months"]
+    ).fetchone()[0]
+    months = [r[0] for r in conn.execute(
+        f"SELECT DISTINCT substr(ts, 1, 7) FROM {AUDIT_TABLE} WHERE ts < ? ORDER BY 1", [cutoff]
+    ).fetchall()]
+    if not months:
+        return {}
+
+    os.makedirs(archive_dir, exist_ok=True)
+    moved: Dict[str, int] = {}
+    for month in months:
+        path = archive_path(archive_dir, month)
+        lo, hi = month + "-01", conn.execute("SELECT date(?, '+1 month')", [month + "-01"]).fetchone()[0]
+        conn.execute("ATTACH DATABASE ? AS audit_arc", [path])
+        try:
+            conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS audit_arc.{AUDIT_TABLE} (
+                    id INTEGER PRIMARY KEY,
+                    ts TEXT NOT NULL,
+                    action TEXT,
+                    table_name TEXT,
+                    rowid INTEGER,
+                    old_values TEXT,
+                    new_values TEXT
+                )"""
+            )
+            ensure_indexes(conn, "audit_arc")
+            conn.execute(
+                f"INSERT OR IGNORE INTO audit_arc.{AUDIT_TABLE} "
+                f"SELECT id, ts, action, table_name, rowid, old_values, new_values "
+                f"FROM main.{AUDIT_TABLE} WHERE ts >= ? AND ts < ?",
+                [lo, hi],
+            )
+            conn.commit()
+
+            cur = conn.execute(
+                f"DELETE FROM main.{AUDIT_TABLE} WHERE ts >= ? AND ts < ? "
+                f"AND id IN (SELECT id FROM audit_arc.{AUDIT_TABLE})",
+                [lo, hi],
+            )
+            moved[month] = cur.rowcount
+            total = conn.execute(f"SELECT count(*) FROM audit_arc.{AUDIT_TABLE}").fetchone()[0]
+            _ensure_archive_table(conn)
+            conn.execute(
+                f"INSERT INTO {ARCHIVE_TABLE}(month, path, rows) VALUES (?, ?, ?) "
+                f"ON CONFLICT(month) DO UPDATE SET path = excluded.path, rows = excluded.rows, ts = CURRENT_TIMESTAMP",
+                [month, os.path.abspath(path), total],
+            )
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("DETACH DATABASE audit_arc")
+    return moved
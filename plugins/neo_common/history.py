@@ -0,0 +1,212 @@
+# plugins/neo_common/history.py
+# ------------------------------------------------------------
+# Ricostruzione di una riga nel tempo a partire da audit_dml
+# (funzioni sincrone su una sqlite3.Connection, per db.execute_fn).
+#
+# Ogni evento di una riga si applica allo stato precedente:
+#   INSERT -> new_values (snapshot completo)
+#   UPDATE -> stato.update(new_values)   (completo o solo colonne cambiate)
+#   DELETE -> None
+#
+# Gli eventi di una riga si leggono con l'indice (table_name, rowid) di
+# audit_dml, che ha id come suffisso implicito (id è la rowid), quindi
+# "id > ? AND id <= ? ORDER BY id" è un range sull'indice.
+# Per non ripartire ogni volta dal primo INSERT, lo stato viene salvato in
+# audit_checkpoint quando una ricostruzione ha dovuto applicare più di
+# CHECKPOINT_EVERY eventi: il costo resta limitato a quel numero di eventi
+# più una ricerca del checkpoint. Se la storia iniziale è stata spostata
+# negli archivi mensili (audit.rollover), viene letta da lì.
+# ------------------------------------------------------------
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from .audit import AUDIT_TABLE, archives, audit_triggers
+
+CHECKPOINT_TABLE = "audit_checkpoint"
+CHECKPOINT_EVERY = 50
+
+_EVENT_COLS = "id, ts, action, old_values, new_values"
+
+
+def alias_for(conn, table: str) -> str:
+    """Nome usato in audit_dml.table_name per la tabella (alias del trigger audit)."""
+    for alias, t in audit_triggers(conn).items():
+        if t["table"] == table:
+            return alias
+    return table
+
+
+def ensure_checkpoint_table(conn) -> None:
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+            table_name TEXT NOT NULL,
+            rowid INTEGER NOT NULL,
+            audit_id INTEGER NOT NULL,
+            row_json TEXT,
+            PRIMARY KEY (table_name, rowid, audit_id)
+        ) WITHOUT ROWID"""
+    )
+
+
+def _has_table(conn, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [name]
+    ).fetchone() is not None
+
+
+def _checkpoint(conn, alias: str, rowid: int, upto: int) -> Tuple[int, Optional[dict], bool]:
+    """(audit_id, stato, trovato) dell'ultimo checkpoint con audit_id <= upto."""
+    if not _has_table(conn, CHECKPOINT_TABLE):
+        return 0, None, False
+    row = conn.execute(
+        f"SELECT audit_id, row_json FROM {CHECKPOINT_TABLE} "
+        f"WHERE table_name = ? AND rowid = ? AND audit_id <= ? ORDER BY audit_id DESC LIMIT 1",
+        [alias, rowid, upto],
+    ).fetchone()
+    if not row:
+        return 0, None, False
+    return row[0], (json.loads(row[1]) if row[1] else None), True
+
+
+def _events(conn, alias: str, rowid: int, after: int, upto: int) -> List[tuple]:
+    return conn.execute(
+        f"SELECT {_EVENT_COLS} FROM {AUDIT_TABLE} "
+        f"WHERE table_name = ? AND rowid = ? AND id > ? AND id <= ? ORDER BY id",
+        [alias, rowid, after, upto],
+    ).fetchall()
+
+
+def _archived_events(conn, alias: str, rowid: int, after: int, before: int) -> List[tuple]:
+    out: List[tuple] = []
+    for _, path in archives(conn):
+        try:
+            arc = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        except sqlite3.Error:
+            continue
+        try:
+            out.extend(arc.execute(
+                f"SELECT {_EVENT_COLS} FROM {AUDIT_TABLE} "
+                f"WHERE table_name = ? AND rowid = ? AND id > ? AND id < ? ORDER BY id",
+                [alias, rowid, after, before],
+            ).fetchall())
+        except sqlite3.Error:
+            pass
+        finally:
+            arc.close()
+    return sorted(out)
+
+
+def _apply(state: Optional[dict], action: str, new_values: Optional[str]) -> Optional[dict]:
+    action = (action or "").upper()
+    if action == "DELETE":
+        return None
+    values = json.loads(new_values) if new_values else {}
+    if action == "INSERT" or state is None:
+        return dict(values)
+    state = dict(state)
+    state.update(values)
+    return state
+
+
+def _load(
+    conn, alias: str, rowid: int, upto: int, cp_upto: Optional[int] = None
+) -> Tuple[Optional[dict], int, List[tuple]]:
+    """
+    Stato di partenza (ultimo checkpoint con audit_id <= cp_upto, default
+    upto), suo audit_id ed eventi successivi fino a upto inclusi.
+    """
+    base_id, state, found = _checkpoint(conn, alias, rowid, upto if cp_upto is None else cp_upto)
+    events = _events(conn, alias, rowid, base_id, upto)
+    if not found and (not events or (events[0][2] or "").upper() != "INSERT"):
+        # L'INSERT iniziale può essere già stato archiviato
+        first = events[0][0] if events else upto + 1
+        events = _archived_events(conn, alias, rowid, base_id, first) + events
+    return state, base_id, events
+
+
+# Una sola discesa sull'indice idx_audit_dml_ts (l'indice ha id come suffisso):
+# max(id) WHERE ts <= ? leggerebbe invece tutto l'intervallo di ts.
+_UPTO_SQL = f"SELECT id FROM {AUDIT_TABLE} WHERE ts <= ? ORDER BY ts DESC, id DESC LIMIT 1"
+
+
+def upto_for_ts(conn, at: str) -> int:
+    """Ultimo audit_dml.id con ts <= at (indice su ts; gli id crescono con ts)."""
+    row = conn.execute(_UPTO_SQL, [at]).fetchone()
+    upto = row[0] if row else 0
+    if not upto:
+        for _, path in reversed(archives(conn)):
+            arc = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                row = arc.execute(_UPTO_SQL, [at]).fetchone()
+            finally:
+                arc.close()
+            if row:
+                upto = row[0]
+                break
+    return upto
+
+
+def row_at(conn, table: str, rowid: int, upto: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Stato della riga dopo l'evento upto (default: l'ultimo).
+    Ritorna {"row", "audit_id", "applied", "checkpoint"}: checkpoint è lo
+    stato da salvare con save_checkpoint() se la ricostruzione è stata lunga.
+    """
+    alias = alias_for(conn, table)
+    if upto is None:
+        upto = conn.execute(f"SELECT max(id) FROM {AUDIT_TABLE}").fetchone()[0] or 0
+    state, base_id, events = _load(conn, alias, rowid, upto)
+    last = base_id
+    for ev in events:
+        state = _apply(state, ev[2], ev[4])
+        last = ev[0]
+    out = {"row": state, "audit_id": last, "applied": len(events), "checkpoint": None}
+    if len(events) > CHECKPOINT_EVERY:
+        out["checkpoint"] = (alias, rowid, last, state)
+    return out
+
+
+def versions(conn, table: str, rowid: int, limit: int = 100) -> Dict[str, Any]:
+    """Ultime `limit` versioni della riga (dalla più recente), ognuna con le colonne cambiate."""
+    alias = alias_for(conn, table)
+    recent = conn.execute(
+        f"SELECT id FROM {AUDIT_TABLE} WHERE table_name = ? AND rowid = ? ORDER BY id DESC LIMIT ?",
+        [alias, rowid, limit],
+    ).fetchall()
+    if not recent:
+        return {"versions": [], "checkpoint": None}
+    first, upto = recent[-1][0], recent[0][0]
+
+    state, base_id, events = _load(conn, alias, rowid, upto, first - 1)
+    out: List[Dict[str, Any]] = []
+    replayed, last, cp = 0, base_id, None
+    for ev in events:
+        if ev[0] < first:
+            # eventi prima della finestra mostrata: servono solo a ricostruire lo stato
+            state = _apply(state, ev[2], ev[4])
+            last, replayed = ev[0], replayed + 1
+            continue
+        if cp is None and replayed > CHECKPOINT_EVERY:
+            cp = (alias, rowid, last, state)
+        before = state
+        state = _apply(state, ev[2], ev[4])
+        keys = set(before or {}) | set(state or {})
+        changed = sorted(k for k in keys if (before or {}).get(k) != (state or {}).get(k))
+        out.append({"audit_id": ev[0], "ts": ev[1], "action": ev[2], "changed": changed, "row": state})
+    out.reverse()
+    return {"versions": out, "checkpoint": cp}
+
+
+def save_checkpoint(conn, checkpoint) -> None:
+    """Salva e fa COMMIT (altrimenti la connessione di scrittura resta in transazione)."""
+    alias, rowid, audit_id, state = checkpoint
+    with conn:
+        ensure_checkpoint_table(conn)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {CHECKPOINT_TABLE}(table_name, rowid, audit_id, row_json) VALUES (?, ?, ?, ?)",
+            [alias, rowid, audit_id, json.dumps(state) if state is not None else None],
+        )
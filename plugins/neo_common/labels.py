@@ -0,0 +1,168 @@
+# plugins/neo_common/labels.py
+# ------------------------------------------------------------
+# Cache condivisa id -> label per le tabelle di lookup
+# (persona, luogo, interrotto, dove_sborra, come_viene, ...).
+#
+# - LRU con tetto massimo di label (LABEL_CACHE_MAX): una voce che è un
+#   elenco pesa quanto le label che contiene, non una sola voce
+# - Invalidazione per tabella: ad ogni refresh() legge solo le righe di
+#   audit_dml con id > ultimo id visto (ricerca per PK, costo trascurabile)
+#   e butta le voci delle tabelle toccate.
+# - Senza audit_dml non c'è modo di sapere cosa è cambiato: la cache resta
+#   disattivata per quel database e ogni lookup va in SQL.
+#
+# Uso tipico (una volta per richiesta):
+#   await LABEL_CACHE.refresh(db, dbname)
+#   labels = await LABEL_CACHE.labels(db, dbname, "persona", "id", "nome", ids)
+# ------------------------------------------------------------
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import threading
+
+from .stats import STATS
+
+LABEL_CACHE_MAX = 5000
+
+# Massimo numero di ID per singola IN (...) (limite variabili SQLite)
+IN_CHUNK = 500
+
+_MISSING = object()  # ID inesistente (cache negativa)
+
+
+def _weight_of(val) -> int:
+    """Label contenute in una voce: 1 per una label singola, len() per un elenco."""
+    if isinstance(val, (list, tuple, dict)):
+        return max(1, len(val))
+    return 1
+
+
+def _qident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class LabelCache:
+    def __init__(self, maxsize: int = LABEL_CACHE_MAX):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._weight = 0  # label in cache (somma di _weight_of sulle voci)
+        self._last_audit_id: Dict[str, Optional[int]] = {}  # db -> ultimo audit_dml.id visto (None = niente audit)
+        self._lock = threading.Lock()
+
+    # —— invalidazione ——
+
+    def enabled(self, dbname: str) -> bool:
+        return self._last_audit_id.get(dbname) is not None
+
+    def invalidate(self, dbname: str, table: Optional[str] = None) -> None:
+        """Scarta le voci di una tabella (o di tutto il database se table è None)."""
+        with self._lock:
+            for key in [k for k in self._data if k[1] == dbname and (table is None or k[2] == table)]:
+                self._weight -= _weight_of(self._data.pop(key))
+
+    async def refresh(self, db, dbname: str) -> None:
+        """Invalida le tabelle con righe audit_dml più recenti dell'ultimo id visto."""
+        last = self._last_audit_id.get(dbname)
+        try:
+            if last is None:
+                row = (await db.execute("SELECT max(id) AS last FROM audit_dml")).first()
+                self.invalidate(dbname)
+                self._last_audit_id[dbname] = int(row["last"] or 0) if row else 0
+                return
+            res = await db.execute(
+                "SELECT table_name, max(id) AS last FROM audit_dml WHERE id > ? GROUP BY table_name",
+                [last],
+            )
+        except Exception:
+            # audit_dml assente/illeggibile: cache disattivata per questo db
+            self.invalidate(dbname)
+            self._last_audit_id[dbname] = None
+            return
+        if not res.rows:
+            return
+        changed = {r["table_name"] for r in res.rows}
+        # audit_dml.table_name può essere un alias (es. 'lista_farmaci' per
+        # meta_lista_farmaci): il nome vero è il tbl_name del trigger audit__<alias>__*
+        try:
+            trg = await db.execute(
+                "SELECT name, tbl_name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'audit\\_\\_%' ESCAPE '\\'"
+            )
+            aliases = {r["name"].split("__")[1]: r["tbl_name"] for r in trg.rows if r["name"].count("__") >= 2}
+        except Exception:
+            aliases = {}
+        for t in changed:
+            self.invalidate(dbname, t)
+            if aliases.get(t) and aliases[t] != t:
+                self.invalidate(dbname, aliases[t])
+        self._last_audit_id[dbname] = max(int(r["last"]) for r in res.rows)
+
+    # —— LRU ——
+
+    def _get(self, key):
+        with self._lock:
+            val = self._data.get(key, None)
+            STATS.cache("labels", val is not None)
+            if val is None:
+                return None
+            self._data.move_to_end(key)
+            return val
+
+    def _put(self, key, val) -> None:
+        weight = _weight_of(val)
+        if weight > self.maxsize:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._weight -= _weight_of(old)
+            self._data[key] = val
+            self._weight += weight
+            while self._weight > self.maxsize:
+                self._weight -= _weight_of(self._data.popitem(last=False)[1])
+
+    # —— lookup ——
+
+    async def labels(
+        self, db, dbname: str, table: str, pk: str, label_col: str, ids: List[Any]
+    ) -> Dict[str, str]:
+        """
+        Ritorna {str(id): label} per gli ID trovati (label non NULL).
+        Gli ID mancanti in cache vengono letti con SELECT ... WHERE pk IN (...).
+        """
+        use_cache = self.enabled(dbname)
+        out: Dict[str, str] = {}
+        todo: List[str] = []
+        for v in ids:
+            sid = str(v)
+            if sid in out or sid in todo:
+                continue
+            hit = self._get(("id", dbname, table, pk, label_col, sid)) if use_cache else None
+            if hit is None:
+                todo.append(sid)
+            elif hit is not _MISSING:
+                out[sid] = hit
+
+        for i in range(0, len(todo), IN_CHUNK):
+            chunk = todo[i:i + IN_CHUNK]
+            ph = ",".join("?" for _ in chunk)
+            sql = (
+                f"SELECT {_qident(pk)} AS id, {_qident(label_col)} AS label "
+                f"FROM {_qident(table)} WHERE {_qident(pk)} IN ({ph})"
+            )
+            found: Dict[str, str] = {}
+            for row in (await db.execute(sql, chunk)).rows:
+                if row["label"] is not None:
+                    found[str(row["id"])] = str(row["label"])
+            out.update(found)
+            if use_cache:
+                for sid in chunk:
+                    self._put(("id", dbname, table, pk, label_col, sid), found.get(sid, _MISSING))
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._data), "labels": self._weight, "max": self.maxsize}
+
+
+LABEL_CACHE = LabelCache()
@@ -0,0 +1,281 @@
+# plugins/neo_common/rowset.py
+# ------------------------------------------------------------
+# Riepilogo condiviso del rowset filtrato di una pagina tabellare.
+#
+# auto_hide_empty_columns (colonne vuote) e fk_pretty_where (conteggio righe)
+# scansionavano le stesse righe con lo stesso WHERE. Qui una sola query
+# calcola entrambe le cose:
+#   SELECT count(*), MAX(<non vuoto>(c1)), MAX(<non vuoto>(c2)), ... FROM t WHERE ...
+#
+# - Il risultato è condiviso per richiesta in request.scope["neo_rowset"]
+#   chiave (database, tabella, use_colstats): chi arriva secondo con la stessa
+#   chiave aspetta lo stesso future, niente seconda query. use_colstats è già
+#   normalizzato: con filtri o _where _colstats non si applica e vale False per
+#   tutti, così una pagina filtrata fa una sola query anche se solo uno dei
+#   chiamanti ha colstats attivo.
+# - Fra richieste c'è una cache LRU chiave
+#   (database, tabella, filtri normalizzati, _where, use_colstats, versione dati).
+#   La versione dati viene da PRAGMA data_version + total_changes della
+#   connessione: dopo un commit (anche da un altro processo) il token cambia
+#   e la voce vecchia non viene più colpita, finché l'LRU non la scarta.
+# - I nomi colonna sono in cache per (database, tabella) finché non cambia
+#   PRAGMA schema_version, letto nella stessa execute_fn del token dati.
+# - Senza filtri, se _colstats è attivo, i flag arrivano da lì (count = None).
+#
+# Il riepilogo è un dict:
+#   {"count": int | None, "non_empty": {colonna: bool}, "exact": bool}
+# exact = False se la richiesta ha parametri che non sono colonne (es. voto__gt):
+# i flag restano utilizzabili ma il count non corrisponde alla pagina.
+# ------------------------------------------------------------
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import threading
+
+from .stats import STATS, tracked
+
+SUMMARY_CACHE_MAX = 256
+COLSTATS_TABLE = "_colstats"
+
+_CACHE: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_COLUMNS: Dict[Tuple[str, str], Tuple[int, List[str]]] = {}
+_LOCK = threading.Lock()
+
+
+def qid(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def getlist(qp, key: str):
+    if qp is None:
+        return []
+    getlist_ = getattr(qp, "getlist", None)
+    if callable(getlist_):
+        try:
+            return list(getlist_(key))
+        except Exception:
+            pass
+    get = getattr(qp, "get", None)
+    if callable(get):
+        v = get(key)
+        return [v] if v is not None else []
+    return []
+
+
+def non_empty_sql(expr: str) -> str:
+    """
+    1 se NON vuoto, 0 altrimenti.
+    Vuoto se:
+      - NULL
+      - testo: solo spazi / NBSP / '&nbsp;'
+      - testo: '0','false','f','no','n' (case-insensitive)
+      - numerico: 0
+      - blob: len=0
+    """
+    # NBSP = char(160)
+    trimmed = f"trim(replace(replace({expr}, char(160), ''), '&nbsp;', ''))"
+    lowered = f"lower({trimmed})"
+    return f"""
+    CASE
+      WHEN {expr} IS NULL THEN 0
+      WHEN typeof({expr}) = 'text' AND (
+        length({trimmed}) = 0 OR {lowered} IN ('0','false','f','no','n')
+      ) THEN 0
+      WHEN typeof({expr}) IN ('integer','real') AND {expr} = 0 THEN 0
+      WHEN typeof({expr}) = 'blob' AND length({expr}) = 0 THEN 0
+      ELSE 1
+    END
+    """
+
+
+def user_keys(qp) -> List[str]:
+    """Parametri 'user-facing' (esclusi quelli di servizio che iniziano con _)."""
+    keys = list(qp.keys()) if qp is not None and hasattr(qp, "keys") else []
+    return [k for k in keys if k and not k.startswith("_")]
+
+
+def equality_filters(qp, name_map) -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    Filtri equality normalizzati: [(colonna, (val1, val2, ...)), ...]
+    ordinati per colonna e valori, così l'ordine dei parametri in URL non conta.
+    name_map: {nome_minuscolo: nome_colonna}
+    """
+    out = []
+    for k in user_keys(qp):
+        lk = k.lower()
+        if lk not in name_map:
+            continue
+        vals = [str(v) for v in getlist(qp, k) if v is not None and str(v) != ""]
+        if not vals:
+            continue
+        out.append((name_map[lk], tuple(sorted(set(vals)))))
+    return sorted(out)
+
+
+def build_where(filters, where: Optional[str]):
+    """
+    WHERE dai filtri equality (col=val / col=val1&col=val2).
+    Se presente _where, lo include (pass-through: usalo solo se ti fidi della tua UI).
+    """
+    clauses, params = [], []
+    for name, vals in filters:
+        col = qid(name)
+        if len(vals) == 1:
+            clauses.append(f"{col} = ?")
+            params.append(vals[0])
+        else:
+            ph = ",".join("?" for _ in vals)
+            clauses.append(f"{col} IN ({ph})")
+            params.extend(vals)
+    if where:
+        clauses.append(f"({where})")
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def data_version_token(conn):
+    """
+    Token di versione dei dati visto da questa connessione.
+    data_version cambia quando un'ALTRA connessione fa commit; total_changes
+    copre le scritture fatte dalla connessione stessa. I contatori sono per
+    connessione, quindi il token include anche l'id della connessione.
+    """
+    dv = conn.execute("PRAGMA data_version").fetchone()[0]
+    return (id(conn), dv, conn.total_changes)
+
+
+def _cache_get(key):
+    with _LOCK:
+        val = _CACHE.get(key)
+        if val is not None:
+            _CACHE.move_to_end(key)
+        return val
+
+
+def _cache_put(key, val) -> None:
+    with _LOCK:
+        _CACHE[key] = val
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > SUMMARY_CACHE_MAX:
+            _CACHE.popitem(last=False)
+
+
+def _versions(conn):
+    """(token dati, schema_version) con un solo passaggio sul thread del db."""
+    return data_version_token(conn), conn.execute("PRAGMA schema_version").fetchone()[0]
+
+
+async def _table_columns(db, dbname: str, table: str, schema_version: Optional[int]) -> List[str]:
+    cached = _COLUMNS.get((dbname, table))
+    hit = cached is not None and schema_version is not None and cached[0] == schema_version
+    STATS.cache("rowset_columns", hit)
+    if hit:
+        return cached[1]
+    safe = table.replace("'", "''")
+    res = await db.execute(f"PRAGMA table_info('{safe}')")
+    names = [r["name"] for r in res.rows]
+    if schema_version is not None:
+        _COLUMNS[(dbname, table)] = (schema_version, names)
+    return names
+
+
+async def _from_colstats(db, table: str, names: List[str]) -> Optional[Dict[str, bool]]:
+    """Flag letti da _colstats, oppure None se la tabella non è (interamente) coperta."""
+    try:
+        res = await db.execute(
+            f"SELECT column_name, non_empty_count FROM {qid(COLSTATS_TABLE)} WHERE table_name = ?",
+            [table],
+        )
+    except Exception:
+        return None
+    counts = {r["column_name"]: r["non_empty_count"] for r in res.rows}
+    if not counts or any(n not in counts for n in names):
+        return None
+    return {n: (counts[n] or 0) > 0 for n in names}
+
+
+def _request_params(request):
+    """(query params, _where) della richiesta."""
+    qp = getattr(request, "args", None) or getattr(request, "query_params", None)
+    where = (qp.get("_where") if qp is not None and hasattr(qp, "get") else None) or ""
+    return qp, where
+
+
+async def _compute(datasette, dbname: str, table: str, request, use_colstats: bool, plugin: str):
+    db = tracked(plugin, datasette.databases[dbname])
+    qp, where = _request_params(request)
+
+    token = schema_version = None
+    try:
+        token, schema_version = await db.execute_fn(_versions)
+    except Exception as e:
+        print("[rowset] data_version non disponibile:", e)
+
+    names = await _table_columns(db, dbname, table, schema_version)
+    if not names:
+        return None
+    name_map = {n.lower(): n for n in names}
+    filters = equality_filters(qp, name_map)
+    exact = all(k.lower() in name_map for k in user_keys(qp))
+    use_colstats = use_colstats and not filters and not where
+
+    key = None
+    if token is not None:
+        key = (dbname, table, tuple(filters), where, use_colstats, token)
+        hit = _cache_get(key)
+        STATS.cache("rowset", hit is not None)
+        if hit is not None:
+            return dict(hit, exact=exact)
+
+    summary = None
+    if use_colstats:
+        flags = await _from_colstats(db, table, names)
+        if flags is not None:
+            summary = {"count": None, "non_empty": flags}
+
+    if summary is None:
+        where_sql, params = build_where(filters, where)
+        fields = ["count(*) AS __count__"] + [
+            f"MAX({non_empty_sql(qid(n))}) AS {qid('__keep__' + n)}" for n in names
+        ]
+        sql = f"SELECT {', '.join(fields)} FROM {qid(table)} {where_sql}"
+        row = (await db.execute(sql, params)).first()
+        if row is None:
+            return None
+        summary = {
+            "count": int(row["__count__"]),
+            "non_empty": {n: int(row["__keep__" + n] or 0) == 1 for n in names},
+        }
+
+    if key is not None:
+        _cache_put(key, summary)
+    return dict(summary, exact=exact)
+
+
+async def rowset_summary(
+    datasette, dbname: str, table: str, request, use_colstats: bool = False, plugin: str = "rowset"
+) -> Optional[Dict[str, Any]]:
+    """
+    Riepilogo (count + colonne non vuote) del rowset filtrato della richiesta,
+    calcolato al più una volta per richiesta. None in caso di errore.
+    Le query vengono attribuite a 'plugin' in /-/plugin-stats.
+    """
+    scope = getattr(request, "scope", None)
+    per_request = scope.setdefault("neo_rowset", {}) if isinstance(scope, dict) else {}
+    qp, where = _request_params(request)
+    use_colstats = bool(use_colstats) and not where and not user_keys(qp)
+    fut_key = (dbname, table, use_colstats)
+    fut = per_request.get(fut_key)
+    if fut is None:
+        async def run():
+            try:
+                return await _compute(datasette, dbname, table, request, use_colstats, plugin)
+            except Exception as e:
+                print("[rowset] ERROR:", table, e)
+                return None
+
+        fut = asyncio.ensure_future(run())
+        per_request[fut_key] = fut
+    return await fut
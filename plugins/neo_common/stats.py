@@ -0,0 +1,143 @@
+# plugins/neo_common/stats.py
+# ------------------------------------------------------------
+# Strumentazione leggera dei plugin, esposta su /-/plugin-stats
+# (route registrata da plugins/plugin_stats.py).
+#
+# - STATS.hook(plugin, hook): context manager che conta chiamate e tempo
+#   (totale + p95 su una finestra delle ultime HOOK_WINDOW chiamate)
+# - tracked(plugin, db): proxy del Database di Datasette che conta e
+#   cronometra ogni execute*/execute_write* attribuendolo al plugin
+# - STATS.cache(name, hit): contatori hit/miss delle cache
+# - STATS.info(name, data): blocchi informativi liberi (es. pragma di avvio)
+# ------------------------------------------------------------
+
+from __future__ import annotations
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Dict
+
+HOOK_WINDOW = 1000
+
+
+def _p95(samples) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class PluginStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.since = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._calls: Dict[tuple, int] = defaultdict(int)
+        self._total: Dict[tuple, float] = defaultdict(float)
+        self._window: Dict[tuple, deque] = defaultdict(lambda: deque(maxlen=HOOK_WINDOW))
+        self._sql: Dict[str, list] = defaultdict(lambda: [0, 0.0])  # plugin -> [statements, seconds]
+        self._cache: Dict[str, list] = defaultdict(lambda: [0, 0])  # cache -> [hits, misses]
+        self._info: Dict[str, Any] = getattr(self, "_info", {})
+
+    @contextmanager
+    def hook(self, plugin: str, hook: str):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.record_hook(plugin, hook, perf_counter() - t0)
+
+    def record_hook(self, plugin: str, hook: str, seconds: float) -> None:
+        key = (plugin, hook)
+        self._calls[key] += 1
+        self._total[key] += seconds
+        self._window[key].append(seconds)
+
+    def record_sql(self, plugin: str, seconds: float, statements: int = 1) -> None:
+        entry = self._sql[plugin]
+        entry[0] += statements
+        entry[1] += seconds
+
+    def cache(self, name: str, hit: bool) -> None:
+        self._cache[name][0 if hit else 1] += 1
+
+    def info(self, name: str, data: Any) -> None:
+        self._info[name] = data
+
+    def snapshot(self) -> Dict[str, Any]:
+        plugins: Dict[str, Any] = defaultdict(lambda: {"hooks": {}, "sql": {"statements": 0, "total_ms": 0.0}})
+        for (plugin, hook), calls in self._calls.items():
+            total = self._total[(plugin, hook)]
+            plugins[plugin]["hooks"][hook] = {
+                "calls": calls,
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total * 1000 / calls, 3) if calls else 0.0,
+                "p95_ms": round(_p95(self._window[(plugin, hook)]) * 1000, 3),
+            }
+        for plugin, (statements, seconds) in self._sql.items():
+            plugins[plugin]["sql"] = {"statements": statements, "total_ms": round(seconds * 1000, 3)}
+        caches = {}
+        for name, (hits, misses) in self._cache.items():
+            total = hits + misses
+            caches[name] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 4) if total else None,
+            }
+        return {
+            "since": self.since,
+            "plugins": dict(plugins),
+            "caches": caches,
+            "info": dict(self._info),
+        }
+
+
+STATS = PluginStats()
+
+
+class _TrackedDatabase:
+    """Proxy di datasette.database.Database: conta e cronometra le query per plugin."""
+
+    __slots__ = ("_db", "_plugin")
+
+    def __init__(self, db, plugin: str):
+        self._db = db
+        self._plugin = plugin
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    async def _timed(self, method: str, *args, **kwargs):
+        t0 = perf_counter()
+        try:
+            return await getattr(self._db, method)(*args, **kwargs)
+        finally:
+            STATS.record_sql(self._plugin, perf_counter() - t0)
+
+    async def execute(self, *args, **kwargs):
+        return await self._timed("execute", *args, **kwargs)
+
+    async def execute_fn(self, *args, **kwargs):
+        return await self._timed("execute_fn", *args, **kwargs)
+
+    async def execute_write(self, *args, **kwargs):
+        return await self._timed("execute_write", *args, **kwargs)
+
+    async def execute_write_fn(self, *args, **kwargs):
+        return await self._timed("execute_write_fn", *args, **kwargs)
+
+    async def execute_write_script(self, *args, **kwargs):
+        return await self._timed("execute_write_script", *args, **kwargs)
+
+    async def execute_write_many(self, *args, **kwargs):
+        return await self._timed("execute_write_many", *args, **kwargs)
+
+
+def tracked(plugin: str, db):
+    """db con le query attribuite a 'plugin' (idempotente)."""
+    if isinstance(db, _TrackedDatabase):
+        return db
+    return _TrackedDatabase(db, plugin)
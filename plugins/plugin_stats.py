@@ -0,0 +1,41 @@
+# plugins/plugin_stats.py
+# ------------------------------------------------------------
+# GET /-/plugin-stats  ->  JSON con, per plugin:
+#   - chiamate, tempo totale/medio e p95 di ogni hook
+#   - numero di statement SQL e tempo speso in SQL
+# più hit rate delle cache condivise e info di avvio.
+# I dati sono raccolti da neo_common.stats (in memoria, dal riavvio).
+# POST /-/plugin-stats (reset=1 nel body) azzera i contatori; il GET non
+# modifica nulla. Entrambi richiedono view-instance come il resto di Datasette
+# (e il POST passa dal controllo CSRF).
+# ------------------------------------------------------------
+
+import os
+import sys
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common.labels import LABEL_CACHE  # noqa: E402
+from neo_common.stats import STATS  # noqa: E402
+
+
+@hookimpl
+def register_routes():
+    return [(r"^/-/plugin-stats$", plugin_stats)]
+
+
+async def plugin_stats(request, datasette):
+    if not await datasette.permission_allowed(request.actor, "view-instance", default=True):
+        return Response.json({"ok": False, "error": "Permission denied"}, status=403)
+    if request.method == "POST":
+        form = await request.post_vars()
+        if form.get("reset") in ("1", "true", "yes"):
+            STATS.reset()
+    data = STATS.snapshot()
+    data["caches"].setdefault("labels", {}).update(LABEL_CACHE.stats())
+    return Response.json(data)
@@ -1,6 +1,21 @@
 from datasette import hookimpl
 from markupsafe import Markup
 from datetime import datetime, date
+from functools import lru_cache
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common.stats import STATS  # noqa: E402
+
+PLUGIN = "render_ui"
 
 ARROW_HTML = "&#10145;"  # ➡️
 
@@ -18,6 +33,23 @@ BOOLEAN_NAMES_HINT = {
     "viene_sega", "completo", "fuori", "cruising"
 }
 
+_BOOL_PREFIXES = ("is_", "has_", "can_", "flag_", "bool_", "do_", "did_")
+_INTISH_TYPES = ("", "INT", "INTEGER", "TINYINT", "SMALLINT", "BIT")
+
+# Colonne booleane dichiarate a mano (table_schema, table_name, column_name)
+BOOLEANS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "booleans.csv")
+
+# Classificazione precalcolata: (database, table) -> {colonna: è_booleana}
+# Costruita una volta da PRAGMA table_info + booleans.csv + registry
+# (meta_column_type.type_key = 'boolean'); buttata quando cambia lo schema
+# o il registry. Il controllo (schema_version + registry + table_info) passa
+# da db.execute_fn al massimo ogni _SCHEMA_CHECK_SECONDS: in quel caso
+# render_cell restituisce una coroutine che Datasette attende; altrimenti è
+# solo un lookup in dict per cella, senza query né lock sul loop.
+_SCHEMA_CHECK_SECONDS = 2.0
+_BOOL_COLS = {}
+_BOOL_STATE = {}  # database -> (checked_at, schema_version, registry booleans)
+
 _DT_PATTERNS = (
     "%Y-%m-%dT%H:%M:%S.%f%z",
     "%Y-%m-%dT%H:%M:%S%z",
@@ -32,34 +64,87 @@ _DT_PATTERNS = (
 )
 _DATE_PATTERNS = ("%Y-%m-%d",)
 
+# Pre-filtro: tutti i formati gestiti iniziano con YYYY-MM-DD.
+# Le stringhe che non passano (testo libero, URL, ...) non toccano strptime.
+_DT_PREFIX_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Formato imparato per colonna: (database, table, column) -> "iso" | pattern | _NOT_DATE.
+# Il primo valore riconosciuto fissa il formato, i successivi provano prima quello.
+# Una colonna diventa _NOT_DATE dopo _NOT_DATE_AFTER valori non vuoti scartati
+# senza nessun match (es. workflowy): da lì in poi non si prova più a parsare.
+# Solo per le pagine tabellari: con Custom SQL (table None) query diverse
+# condividerebbero la stessa chiave. Le voci di un database vengono buttate
+# quando cambia il suo schema_version, e tutto quando si supera _COL_CACHE_MAX.
+_ISO = "iso"
+_NOT_DATE = object()
+_NOT_DATE_AFTER = 50
+_COL_CACHE_MAX = 4096
+_COL_FORMAT = {}
+_COL_MISSES = {}
+
 
 def _is_anchor_html(val: str) -> bool:
     s = val.lstrip().lower()
     return s.startswith("<a ") and ("href=" in s)
 
 
-def _parse_dt(value: str):
+def _try_format(v: str, fmt):
+    """Parsa v con un formato noto; None se non corrisponde."""
+    try:
+        if fmt == _ISO:
+            return datetime.fromisoformat(v)
+        if fmt in _DATE_PATTERNS:
+            return datetime.combine(datetime.strptime(v, fmt).date(), datetime.min.time())
+        return datetime.strptime(v, fmt)
+    except ValueError:
+        return None
+
+
+def _parse_dt(value: str, key=None):
+    """
+    Datetime da stringa, o None. key = (database, table, column) abilita
+    l'apprendimento del formato per colonna (vedi _COL_FORMAT).
+    """
     v = value.strip()
+    if not v:
+        return None
+    if key is not None and len(_COL_FORMAT) + len(_COL_MISSES) > _COL_CACHE_MAX:
+        _COL_FORMAT.clear()
+        _COL_MISSES.clear()
+    learned = _COL_FORMAT.get(key) if key is not None else None
+    if learned is _NOT_DATE:
+        return None
+    if not _DT_PREFIX_RE.match(v):
+        if key is not None and learned is None:
+            misses = _COL_MISSES.get(key, 0) + 1
+            _COL_MISSES[key] = misses
+            if misses >= _NOT_DATE_AFTER:
+                _COL_FORMAT[key] = _NOT_DATE
+        return None
     if v.endswith("Z"):
         v = v[:-1] + "+00:00"
-    try:
-        return datetime.fromisoformat(v)
-    except Exception:
-        pass
-    for pat in _DT_PATTERNS:
-        try:
-            return datetime.strptime(v, pat)
-        except Exception:
-            continue
-    for pat in _DATE_PATTERNS:
-        try:
-            d = datetime.strptime(v, pat).date()
-            return datetime.combine(d, datetime.min.time())
-        except Exception:
+    if learned is not None:
+        dt = _try_format(v, learned)
+        if dt is not None:
+            return dt
+    for fmt in (_ISO,) + _DT_PATTERNS + _DATE_PATTERNS:
+        if fmt == learned:
             continue
+        dt = _try_format(v, fmt)
+        if dt is not None:
+            if key is not None:
+                _COL_FORMAT[key] = fmt
+            return dt
     return None
 
 
+def _forget_formats(database: str) -> None:
+    """Dimentica i formati imparati per un database (schema cambiato)."""
+    for d in (_COL_FORMAT, _COL_MISSES):
+        for key in [k for k in d if k[0] == database]:
+            del d[key]
+
+
 def _format_dt_ddmmyy_hhmm(dt: datetime) -> str:
     return dt.strftime("%d-%m-%y %H:%M")
 
@@ -79,28 +164,134 @@ def _as_boolish(value):
     return None
 
 
-def _is_bool_column(column: str, table: str | None, database: str, datasette) -> bool:
-    if not column:
+def _load_booleans_csv():
+    out = set()
+    try:
+        with open(BOOLEANS_CSV, newline="", encoding="utf-8") as f:
+            for r in csv.DictReader(f):
+                if r.get("table_name") and r.get("column_name"):
+                    out.add((r["table_name"], r["column_name"]))
+    except Exception:
+        pass
+    return frozenset(out)
+
+
+_CSV_BOOLEANS = _load_booleans_csv()
+
+
+@lru_cache(maxsize=4096)
+def _bool_by_name(column: str) -> bool:
+    """Regola sul solo nome (tabella sconosciuta, Custom SQL, colonne non in schema)."""
+    name = column.lower()
+    if name.endswith("_id"):
         return False
+    return name in BOOLEAN_NAMES_HINT or name.startswith(_BOOL_PREFIXES)
+
+
+def _classify_column(table: str, column: str, ctype: str, registry) -> bool:
     name = column.lower()
     if name.endswith("_id"):
         return False
+    if (table, column) in registry or (table, column) in _CSV_BOOLEANS:
+        return True
+    t = (ctype or "").upper()
+    if "BOOL" in t:
+        return True
+    if t in _INTISH_TYPES and (name in BOOLEAN_NAMES_HINT or name.startswith(_BOOL_PREFIXES)):
+        return True
+    return name in BOOLEAN_NAMES_HINT
+
+
+def _registry_booleans(conn):
     try:
-        info = datasette.inspect().get(database, {}).get("tables", {}).get(table or "", {})
-        col_types = {c["name"]: (c.get("type") or "").upper() for c in info.get("columns", [])}
-        t = col_types.get(column, "")
-        if "BOOL" in t:
-            return True
-        if t in ("", "INT", "INTEGER", "TINYINT", "SMALLINT", "BIT"):
-            if name in BOOLEAN_NAMES_HINT or name.startswith(("is_", "has_", "can_", "flag_", "bool_", "do_", "did_")):
-                return True
+        rows = conn.execute(
+            "SELECT t.name, c.name FROM meta_column_type ct "
+            "JOIN meta_registry_columns c ON c.id = ct.column_id "
+            "JOIN meta_registry_tables t ON t.id = c.table_id "
+            "WHERE ct.type_key = 'boolean'"
+        ).fetchall()
+    except sqlite3.Error:
+        return frozenset()
+    return frozenset((r[0], r[1]) for r in rows)
+
+
+def _needs_refresh(database: str, table: str | None) -> bool:
+    if not table:
+        return False
+    state = _BOOL_STATE.get(database)
+    if state is None or time.monotonic() - state[0] > _SCHEMA_CHECK_SECONDS:
+        return True
+    return (database, table) not in _BOOL_COLS
+
+
+async def _refresh_bool_columns(database: str, table: str, datasette) -> None:
+    """Riallinea _BOOL_STATE/_BOOL_COLS per (database, table) via db.execute_fn."""
+    db = datasette.databases.get(database)
+    if db is None:
+        _BOOL_STATE[database] = (time.monotonic(), None, frozenset())
+        _BOOL_COLS[(database, table)] = {}
+        return
+
+    def read(conn):
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        registry = _registry_booleans(conn)
+        safe = table.replace("'", "''")
+        info = conn.execute(f"PRAGMA table_info('{safe}')").fetchall()
+        return version, registry, [(r[1], r[2]) for r in info]
+
+    t0 = time.perf_counter()
+    try:
+        version, registry, info = await db.execute_fn(read)
     except Exception:
-        pass
-    return name in BOOLEAN_NAMES_HINT
+        version, registry, info = None, frozenset(), []
+    finally:
+        STATS.record_sql(PLUGIN, time.perf_counter() - t0, statements=3)
+
+    state = _BOOL_STATE.get(database)
+    if state is None or state[1] != version or state[2] != registry:
+        for key in [k for k in _BOOL_COLS if k[0] == database]:
+            del _BOOL_COLS[key]
+    if state is not None and state[1] != version:
+        _forget_formats(database)
+    _BOOL_STATE[database] = (time.monotonic(), version, registry)
+    _BOOL_COLS[(database, table)] = {
+        name: _classify_column(table, name, ctype, registry) for name, ctype in info
+    }
+
+
+def _bool_columns(database: str, table: str | None):
+    """Mappa {colonna: è_booleana} per (database, table), o None se non disponibile."""
+    if not table:
+        return None
+    cols = _BOOL_COLS.get((database, table))
+    STATS.cache("render_ui_bool_columns", cols is not None)
+    return cols
+
+
+def _is_bool_column(column: str, table: str | None, database: str) -> bool:
+    if not column:
+        return False
+    cols = _bool_columns(database, table)
+    if cols is not None and column in cols:
+        return cols[column]
+    return _bool_by_name(column)
 
 
 @hookimpl
 def render_cell(value, column, table, database, datasette):
+    if _needs_refresh(database, table):
+        return _render_cell_after_refresh(value, column, table, database, datasette)
+    with STATS.hook(PLUGIN, "render_cell"):
+        return _render_cell(value, column, table, database)
+
+
+async def _render_cell_after_refresh(value, column, table, database, datasette):
+    with STATS.hook(PLUGIN, "render_cell"):
+        await _refresh_bool_columns(database, table, datasette)
+        return _render_cell(value, column, table, database)
+
+
+def _render_cell(value, column, table, database):
     # 1) Rendi sicuri gli <a ...> per tabelle note (pagina tabellare)
     if table in HTML_COLUMNS_BY_TABLE and column in HTML_COLUMNS_BY_TABLE[table]:
         if isinstance(value, str) and _is_anchor_html(value):
@@ -117,7 +308,7 @@ def render_cell(value, column, table, database, datasette):
             return Markup(f'<a href="{value}" target="_blank" rel="noopener">{ARROW_HTML}</a>')
 
     # 4) Booleani → ✅ / ""  (supporta int, bool, stringhe; evita *_id e numeri reali)
-    if _is_bool_column(column or "", table, database, datasette):
+    if _is_bool_column(column or "", table, database):
         b = _as_boolish(value)
         if b is not None:
             return "✅" if b else ""
@@ -127,7 +318,7 @@ def render_cell(value, column, table, database, datasette):
         dt = value if isinstance(value, datetime) else datetime.combine(value, datetime.min.time())
         return _format_dt_ddmmyy_hhmm(dt)
     if isinstance(value, str):
-        dt = _parse_dt(value)
+        dt = _parse_dt(value, (database, table, column) if table else None)
         if dt is not None:
             return _format_dt_ddmmyy_hhmm(dt)
 
@@ -0,0 +1,97 @@
+# plugins/row_history.py
+# ------------------------------------------------------------
+# Storia di una riga ricostruita da audit_dml (vedi neo_common/history.py).
+#
+#   /<db>/<tabella>/<id>/history            -> pagina HTML con le versioni
+#   /<db>/<tabella>/<id>/history.json       -> stesso contenuto in JSON
+#   ...?at=2026-01-15 (o 2026-01-15 10:30)  -> la riga com'era in quel momento
+#   ...?limit=N                             -> ultime N versioni (default 100)
+#
+# <id> è la rowid (per le tabelle con "id INTEGER PRIMARY KEY" coincide con id).
+# Gli orari sono quelli di audit_dml.ts (CURRENT_TIMESTAMP, UTC).
+# I checkpoint in audit_checkpoint vengono scritti in background quando una
+# ricostruzione ha dovuto riapplicare molti eventi.
+# ------------------------------------------------------------
+
+import os
+import sys
+
+from datasette import hookimpl
+from datasette.utils import tilde_decode
+from datasette.utils.asgi import Response
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common import history  # noqa: E402
+from neo_common.stats import STATS, tracked  # noqa: E402
+
+PLUGIN = "row_history"
+
+HISTORY_LIMIT = 100
+HISTORY_LIMIT_MAX = 1000
+
+
+def _normalize_at(at: str) -> str:
+    # "2026-01-15" = fine di quel giorno; "T" come in datetime-local
+    at = at.strip().replace("T", " ")
+    if len(at) == 10:
+        return at + " 23:59:59"
+    if len(at) == 16:
+        return at + ":59"
+    return at
+
+
+def _error(message, status, as_json):
+    if as_json:
+        return Response.json({"ok": False, "error": message}, status=status)
+    return Response.text(message, status=status)
+
+
+async def row_history(request, datasette):
+    with STATS.hook(PLUGIN, "history"):
+        vars_ = request.url_vars
+        as_json = bool(vars_.get("format")) or "application/json" in (request.headers.get("accept") or "")
+        dbname = tilde_decode(vars_["database"])
+        table = tilde_decode(vars_["table"])
+        if dbname not in datasette.databases:
+            return _error(f"Database not found: {dbname}", 404, as_json)
+        db = tracked(PLUGIN, datasette.get_database(dbname))
+        if not await db.table_exists(table) or not await db.table_exists("audit_dml"):
+            return _error(f"No audit history for {table}", 404, as_json)
+        try:
+            rowid = int(tilde_decode(vars_["pk"]))
+            limit = min(max(int(request.args.get("limit") or HISTORY_LIMIT), 1), HISTORY_LIMIT_MAX)
+        except ValueError:
+            return _error("id and limit must be integers", 400, as_json)
+
+        at = request.args.get("at")
+        data = {"database": dbname, "table": table, "id": rowid}
+        if at:
+            at = _normalize_at(at)
+
+            def fn(conn):
+                return history.row_at(conn, table, rowid, history.upto_for_ts(conn, at))
+
+            res = await db.execute_fn(fn)
+            data.update({"at": at, "row": res["row"], "audit_id": res["audit_id"]})
+        else:
+            res = await db.execute_fn(lambda conn: history.versions(conn, table, rowid, limit))
+            data["versions"] = res["versions"]
+
+        if res["checkpoint"] and getattr(db, "is_mutable", True):
+            cp = res["checkpoint"]
+            await db.execute_write_fn(lambda conn: history.save_checkpoint(conn, cp), block=False)
+
+        if as_json:
+            return Response.json(data, default=repr)
+        html = await datasette.render_template("row_history.html", data, request=request)
+        return Response.html(html)
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/(?P<database>[^/]+)/(?P<table>[^/]+)/(?P<pk>[^/]+)/history(?P<format>\.json)?$", row_history),
+    ]
@@ -4,15 +4,43 @@
 # - meta_registry_columns uses column "name" (not "column_name")
 # - meta_type_registry does NOT store fk_table/fk_label_column in this project:
 #   FK options are derived from PRAGMA foreign_key_list(<table>)
-# - Always redirects to /{db}/sesso after successful insert (303) unless client asks for JSON
+# - Every table in meta_registry_tables gets /-/sesso-form/<table>/form, .../insert,
+#   .../insert_batch and .../lookup/<column>. The prefix keeps them from shadowing
+#   Datasette's /<database>/<table> pages (a table called "form" or "insert").
+#   /sesso and /sesso/insert are kept as aliases for the sesso form.
+#   audit_*, meta_* and _* tables are excluded (404) even when registered, so the
+#   audit log and the registry cannot be written from here
+# - .../insert_batch takes a JSON array or NDJSON and inserts it in one transaction
+# - FK pickers are typeahead fields backed by .../lookup/<column>?q=...&limit=20
+#   (FTS on <table>_fts when present, otherwise ranked LIKE on the label column)
+# - Opt-in {"lookup_fts": true}: at startup every FK target without <table>_fts gets
+#   one (FTS5, external content on the label column, kept in sync by the triggers
+#   lookup_fts__<table>__insert/update/delete), so lookups do not fall back to a
+#   full-scan LIKE
+# - Always redirects to /{db}/<table> after successful insert (303) unless client asks for JSON
 #
 # Notes:
-# - This plugin chooses the database that contains table "sesso" (skipping Datasette "_internal").
+# - This plugin chooses the database that contains the table (skipping Datasette "_internal").
 
+import hashlib
 import json
+import os
+import sqlite3
+import sys
+from urllib.parse import quote
 from datasette import hookimpl
 from datasette.utils.asgi import Response
 
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common.labels import LABEL_CACHE  # noqa: E402
+from neo_common.rowset import data_version_token  # noqa: E402
+from neo_common.stats import STATS, tracked  # noqa: E402
+
+PLUGIN = "sesso_form"
+
 
 async def _db_has_table(db, table_name: str) -> bool:
     row = await db.execute(
@@ -22,32 +50,42 @@ async def _db_has_table(db, table_name: str) -> bool:
     return bool(row.rows)
 
 
-async def _choose_db(datasette, request):
+# Database found to contain each table (the set of databases is fixed at startup)
+_TABLE_DB = {}
+
+
+async def _choose_db(datasette, request, table: str = "sesso"):
+    # Returned databases are wrapped so their queries show up in /-/plugin-stats
     # If URL specifies a DB, use it
     db_name = (getattr(request, "url_vars", {}) or {}).get("database")
     if db_name and db_name in datasette.databases:
-        return datasette.get_database(db_name), db_name
+        return tracked(PLUGIN, datasette.get_database(db_name)), db_name
 
-    # Prefer DB containing sesso
+    # Prefer DB containing the table
+    cached = _TABLE_DB.get(table)
+    if cached in datasette.databases:
+        return tracked(PLUGIN, datasette.databases[cached]), cached
     for name, db in datasette.databases.items():
         if name == "_internal":
             continue
-        if await _db_has_table(db, "sesso"):
+        db = tracked(PLUGIN, db)
+        if await _db_has_table(db, table):
+            _TABLE_DB[table] = name
             return db, name
 
     # Fallback first non-internal DB
     for name, db in datasette.databases.items():
         if name != "_internal":
-            return db, name
+            return tracked(PLUGIN, db), name
 
     db = datasette.get_database()
-    return db, getattr(db, "name", "db")
+    return tracked(PLUGIN, db), getattr(db, "name", "db")
 
 
 async def _pragma_foreign_keys(db, table: str):
     # Returns list of dicts from PRAGMA foreign_key_list(table)
     try:
-        res = await db.execute(f"pragma foreign_key_list({table})")
+        res = await db.execute(f"pragma foreign_key_list({_qid(table)})")
         # Datasette returns rows as sqlite3.Row-ish
         out = []
         for r in res.rows:
@@ -64,7 +102,7 @@ async def _pragma_foreign_keys(db, table: str):
 
 async def _table_columns(db, table: str):
     # PRAGMA table_info
-    res = await db.execute(f"pragma table_info({table})")
+    res = await db.execute(f"pragma table_info({_qid(table)})")
     cols = []
     for r in res.rows:
         # cid, name, type, notnull, dflt_value, pk
@@ -105,74 +143,365 @@ async def _pick_label_column(db, table: str, options_json: str | None):
     return "id"
 
 
-async def _meta_fields(db):
-    # Find table_id in meta_registry_tables where name='sesso'
-    t = await db.execute("select id from meta_registry_tables where name = 'sesso' limit 1")
-    if not t.rows:
-        return []
-
-    table_id = t.rows[0][0] if not isinstance(t.rows[0], dict) else t.rows[0]["id"]
-
-    cols = await db.execute(
-        "select id, name from meta_registry_columns where table_id = ? order by id",
-        [table_id],
-    )
-    col_ids = [r[0] for r in cols.rows]
-    col_names = {r[0]: r[1] for r in cols.rows}
-    if not col_ids:
-        return []
-
-    q = ",".join(["?"] * len(col_ids))
-    ct = await db.execute(
-        f"select column_id, type_key, options_json from meta_column_type left join meta_type_registry on meta_column_type.type_key = meta_type_registry.type_key where column_id in ({q})",
-        col_ids,
+# Form descriptor cache: (db_name, table) -> (meta version, {"fields", "columns", "fk"})
+# The version is PRAGMA schema_version plus a checksum of the rows of the meta_*
+# tables (they are small). The checksum is only recomputed when the connection's
+# data_version token moves, i.e. after any commit; otherwise the last version
+# seen by that connection is reused without reading the meta tables.
+_FORM_CACHE = {}
+_META_SEEN = {}  # (db_name, connection id) -> (data_version token, meta version)
+_META_TABLES = ("meta_registry_tables", "meta_registry_columns", "meta_column_type", "meta_type_registry")
+_REGISTRY = {}  # db_name -> (meta version, set of registered table names)
+
+# Registered tables that never get form/insert routes: audit log, the registry
+# itself and internal support tables (_colstats, _matviews, ...). POST
+# /audit_dml/insert would otherwise let anyone forge audit history.
+_SYSTEM_PREFIXES = ("audit_", "meta_", "_", "sqlite_")
+
+
+def _meta_checksum(conn):
+    h = hashlib.sha1()
+    for t in _META_TABLES:
+        h.update(t.encode("utf-8"))
+        for row in conn.execute(f"select * from {_qid(t)} order by rowid"):
+            h.update(repr(tuple(row)).encode("utf-8"))
+    return h.hexdigest()
+
+
+async def _meta_version(db, db_name: str):
+    def fn(conn):
+        token = data_version_token(conn)
+        key = (db_name, token[0])
+        seen = _META_SEEN.get(key)
+        if seen is not None and seen[0] == token:
+            return seen[1]
+        try:
+            sv = conn.execute("pragma schema_version").fetchone()[0]
+            version = (sv, _meta_checksum(conn))
+        except sqlite3.Error:
+            return None  # no meta tables: no caching
+        _META_SEEN[key] = (token, version)
+        return version
+
+    return await db.execute_fn(fn)
+
+
+async def _build_form_schema(db, table: str):
+    # Whole descriptor in one joined query (column -> type -> widget)
+    res = await db.execute(
+        """
+        select c.id, c.name, ct.type_key, tr.ui_widget, tr.options_json
+        from meta_registry_tables t
+        join meta_registry_columns c on c.table_id = t.id
+        left join meta_column_type ct on ct.column_id = c.id
+        left join meta_type_registry tr on tr.type_key = ct.type_key
+        where t.name = ?
+        order by c.id
+        """,
+        [table],
     )
-    # Build map by column_id
-    by_col = {}
-    for r in ct.rows:
-        # r: column_id, type_key, options_json
-        col_id = r[0]
-        by_col[col_id] = {"type_key": r[1], "options_json": r[2]}
-
     fields = []
-    for col_id in col_ids:
-        name = col_names.get(col_id)
+    for r in res.rows:
+        name = r["name"]
         if not name or name.lower() == "id":
             continue
-
-        tk = by_col.get(col_id, {}).get("type_key")
-        # ui_widget from meta_type_registry
-        ui = "text"
-        opt_json = by_col.get(col_id, {}).get("options_json")
-        if tk:
-            tr = await db.execute("select ui_widget from meta_type_registry where type_key = ? limit 1", [tk])
-            if tr.rows and tr.rows[0][0]:
-                ui = tr.rows[0][0]
-
         fields.append({
             "name": name,
-            "type_key": tk,
-            "ui_widget": ui,
-            "options_json": opt_json
+            "type_key": r["type_key"],
+            "ui_widget": r["ui_widget"] or "text",
+            "options_json": r["options_json"],
         })
-    return fields
+
+    # One FK pragma for the table; label column picked once per referenced table
+    fk = {}
+    by_col = {x["from"]: x for x in await _pragma_foreign_keys(db, table)}
+    labels = {}
+    fts = {}
+    for f in fields:
+        ref = by_col.get(f["name"])
+        if f["ui_widget"] not in ("select", "fk", "lookup") or not ref:
+            continue
+        ref_table = ref["table"]
+        key = (ref_table, f["options_json"])
+        if key not in labels:
+            labels[key] = await _pick_label_column(db, ref_table, f["options_json"])
+        if ref_table not in fts:
+            fts[ref_table] = await _fts_table(db, ref_table)
+        fk[f["name"]] = {
+            "table": ref_table,
+            "pk": ref["to"] or "id",
+            "label": labels[key],
+            "fts": fts[ref_table],
+        }
+    return {"fields": fields, "columns": frozenset(f["name"] for f in fields), "fk": fk}
+
+
+async def _registered_tables(db, db_name: str, version):
+    cached = _REGISTRY.get(db_name)
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+    try:
+        res = await db.execute("select name from meta_registry_tables")
+        tables = {
+            r["name"] for r in res.rows
+            if r["name"] and not r["name"].lower().startswith(_SYSTEM_PREFIXES)
+        }
+    except Exception:
+        tables = set()
+    if version is not None:
+        _REGISTRY[db_name] = (version, tables)
+    return tables
+
+
+async def _form_schema(db, db_name: str, table: str = "sesso"):
+    # None when the table is not described in meta_registry_tables
+    version = await _meta_version(db, db_name)
+    if table not in await _registered_tables(db, db_name, version):
+        return None
+    cached = _FORM_CACHE.get((db_name, table))
+    hit = version is not None and cached is not None and cached[0] == version
+    STATS.cache("form_schema", hit)
+    if hit:
+        return cached[1]
+    schema = await _build_form_schema(db, table)
+    if version is not None:
+        _FORM_CACHE[(db_name, table)] = (version, schema)
+    return schema
+
+
+async def _meta_fields(db, db_name: str, table: str = "sesso"):
+    # Registry-driven field list (cached, see _form_schema)
+    schema = await _form_schema(db, db_name, table)
+    return schema["fields"] if schema else []
+
+
+async def _fts_table(db, table: str):
+    # Full-text index in the Datasette convention (<table>_fts, joined on rowid)
+    res = await db.execute(
+        "select name from sqlite_master where type = 'table' and name = ? and sql like '%using fts%'",
+        [table + "_fts"],
+    )
+    return res.rows[0]["name"] if res.rows else None
 
 
-async def _fk_options_for_column(db, base_table: str, col_name: str, options_json: str | None):
-    fks = await _pragma_foreign_keys(db, base_table)
-    fk = next((x for x in fks if x["from"] == col_name), None)
-    if not fk:
+LOOKUP_LIMIT = 20
+LOOKUP_LIMIT_MAX = 100
+
+
+def _qid(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _like_escape(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _fts_query(q: str):
+    # Every word as a quoted prefix term: "ros" "via"* -> rows containing both
+    words = [w for w in q.replace('"', " ").split() if w]
+    if not words:
         return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+async def _lookup(db, fk: dict, q: str, limit: int, offset: int):
+    """Ranked matches on the label column: exact/prefix first, then shorter labels."""
+    t, pk, label = _qid(fk["table"]), _qid(fk["pk"]), _qid(fk["label"])
+    page = [limit + 1, offset]  # one extra row tells the client there is more
+    if not q:
+        sql = f"select {pk} as id, {label} as label from {t} where {label} is not null order by {label} limit ? offset ?"
+        params = page
+    else:
+        prefix = _like_escape(q) + "%"
+        rank = f"order by case when t.{label} like ? escape '\\' then 0 else 1 end, length(t.{label}), t.{label}"
+        match = _fts_query(q) if fk.get("fts") else None
+        if match:
+            fts = _qid(fk["fts"])
+            sql = (
+                f"select t.{pk} as id, t.{label} as label from {t} t "
+                f"join {fts} f on f.rowid = t.rowid where {fts} match ? {rank} limit ? offset ?"
+            )
+            params = [match, prefix, *page]
+        else:
+            sql = (
+                f"select t.{pk} as id, t.{label} as label from {t} t "
+                f"where t.{label} like ? escape '\\' {rank} limit ? offset ?"
+            )
+            params = ["%" + _like_escape(q) + "%", prefix, *page]
+    rows = (await db.execute(sql, params)).rows
+    results = [{"id": r["id"], "label": r["label"]} for r in rows[:limit]]
+    return results, len(rows) > limit
+
+
+def _install_lookup_fts(conn, targets):
+    """
+    <table>_fts for each (table, label column) in targets that has none, in one
+    transaction. Each table gets its own savepoint: a failure (e.g. SQLite built
+    without FTS5) leaves that table on the LIKE fallback.
+    """
+    report = {}
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    with conn:
+        for table, label in sorted(targets):
+            fts = table + "_fts"
+            if conn.execute("select 1 from sqlite_master where name = ?", [fts]).fetchone():
+                continue
+            t, f, c = _qid(table), _qid(fts), _qid(label)
+            conn.execute("savepoint lookup_fts")
+            try:
+                conn.execute(
+                    f"create virtual table {f} using fts5({c}, content='{table.replace(chr(39), chr(39) * 2)}')"
+                )
+                delete = f"insert into {f} ({f}, rowid, {c}) values ('delete', old.rowid, old.{c});"
+                insert = f"insert into {f} (rowid, {c}) values (new.rowid, new.{c});"
+                for event, body in (
+                    ("insert", insert),
+                    ("delete", delete),
+                    ("update", f"{delete}\n  {insert}"),
+                ):
+                    # Namespaced like colstats__/audit__: only our own triggers get replaced
+                    trg = _qid(f"lookup_fts__{table}__{event}")
+                    conn.execute(f"drop trigger if exists {trg}")
+                    conn.execute(f"create trigger {trg} after {event} on {t}\nbegin\n  {body}\nend")
+                conn.execute(f"insert into {f} ({f}) values ('rebuild')")
+                report[table] = label
+            except sqlite3.Error as e:
+                conn.execute("rollback to lookup_fts")
+                report[table] = {"error": str(e)}
+            conn.execute("release lookup_fts")
+    return report
+
+
+async def _lookup_targets(db, db_name: str):
+    # (table, label column) of every FK picker of the registered tables still without FTS
+    version = await _meta_version(db, db_name)
+    targets = set()
+    for table in await _registered_tables(db, db_name, version):
+        schema = await _form_schema(db, db_name, table)
+        for fk in (schema or {}).get("fk", {}).values():
+            if not fk["fts"] and fk["label"] != fk["pk"]:
+                targets.add((fk["table"], fk["label"]))
+    return targets
 
-    ref_table = fk["table"]
-    label_col = await _pick_label_column(db, ref_table, options_json)
 
+@hookimpl
+def startup(datasette):
     try:
-        rows = await db.execute(f"select id, {label_col} as label from {ref_table} order by label")
-        return [{"id": r["id"], "label": r["label"]} for r in rows.rows]
+        conf = datasette.plugin_config(PLUGIN) or {}
     except Exception:
-        rows = await db.execute(f"select id from {ref_table} order by id")
-        return [{"id": r["id"], "label": r["id"]} for r in rows.rows]
+        conf = {}
+    if not conf.get("lookup_fts"):
+        return None
+
+    async def inner():
+        report = {}
+        for name, db in datasette.databases.items():
+            if name == "_internal" or not getattr(db, "is_mutable", True):
+                continue
+            db = tracked(PLUGIN, db)
+            try:
+                targets = await _lookup_targets(db, name)
+                if targets:
+                    report[name] = await db.execute_write_fn(
+                        lambda conn: _install_lookup_fts(conn, targets), block=True
+                    )
+            except Exception as e:
+                report[name] = {"error": str(e)}
+                print("[sesso_form] lookup_fts ERROR:", name, e)
+        STATS.info(PLUGIN, {"lookup_fts": report})
+
+    return inner
+
+
+def _parse_batch(body: bytes):
+    """JSON array of objects, or NDJSON (one object per line) -> [(row, error)]."""
+    text = body.decode("utf-8-sig").strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"invalid JSON: {e}")
+        return [(r, None) if isinstance(r, dict) else (None, "row is not an object") for r in data]
+    out = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            r = json.loads(line)
+        except ValueError as e:
+            out.append((None, f"invalid JSON: {e}"))
+            continue
+        out.append((r, None) if isinstance(r, dict) else (None, "row is not an object"))
+    return out
+
+
+def _batch_items(row: dict, allowed: set):
+    # Same rules as the form insert: empty values are left to the column default
+    items = []
+    for k, v in row.items():
+        if k not in allowed:
+            raise ValueError(f"unknown column: {k}")
+        if v in (None, "", []):
+            continue
+        if isinstance(v, bool):
+            v = int(v)
+        elif not isinstance(v, (str, int, float)):
+            raise ValueError(f"{k}: value must be a scalar")
+        items.append((k, v))
+    if not items:
+        raise ValueError("no data")
+    return items
+
+
+def _insert_batch(conn, table: str, rows):
+    """
+    Insert [(index, items)] in input order inside one transaction, committed
+    at the end. Each id comes from its own cursor.lastrowid (correct also when
+    the PK column is in the allow-list). If any row fails, the whole batch is
+    rolled back to the savepoint and replayed row by row, each row in its own
+    savepoint, so that only the offending rows are skipped and get an error.
+    Returns ({index: id}, {index: error}).
+    """
+    sqls = {}
+
+    def insert(items):
+        cols = tuple(k for k, _ in items)
+        sql = sqls.get(cols)
+        if sql is None:
+            sql = sqls[cols] = (
+                f"insert into {_qid(table)} ({', '.join(_qid(c) for c in cols)}) "
+                f"values ({', '.join('?' * len(cols))})"
+            )
+        return conn.execute(sql, [v for _, v in items]).lastrowid
+
+    ids, errors = {}, {}
+    if not conn.in_transaction:
+        conn.execute("begin")
+    try:
+        conn.execute("savepoint insert_batch")
+        try:
+            for i, items in rows:
+                ids[i] = insert(items)
+        except sqlite3.Error:
+            conn.execute("rollback to insert_batch")
+            ids = {}
+            for i, items in rows:
+                conn.execute("savepoint insert_row")
+                try:
+                    ids[i] = insert(items)
+                except sqlite3.Error as e:
+                    conn.execute("rollback to insert_row")
+                    errors[i] = str(e)
+                conn.execute("release insert_row")
+        conn.execute("release insert_batch")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return ids, errors
 
 
 def _wants_json(request):
@@ -180,39 +509,65 @@ def _wants_json(request):
     return "application/json" in accept
 
 
+def _timed_route(name, handler):
+    # Datasette injects arguments by name, so the wrapper keeps (request, datasette)
+    async def route(request, datasette):
+        with STATS.hook(PLUGIN, name):
+            return await handler(request, datasette)
+    return route
+
+
+async def _resolve(datasette, request):
+    # (db, db_name, table, descriptor); descriptor is None for unregistered tables
+    table = (request.url_vars or {}).get("table") or "sesso"
+    db, db_name = await _choose_db(datasette, request, table)
+    return db, db_name, table, await _form_schema(db, db_name, table)
+
+
+ROUTE_PREFIX = "/-/sesso-form"
+
+
+def _form_url(table: str, action: str) -> str:
+    return f"{ROUTE_PREFIX}/{quote(table, safe='')}/{action}"
+
+
+def _not_registered(table):
+    return Response.json({"ok": False, "error": f"{table} is not in meta_registry_tables"}, status=404)
+
+
 @hookimpl
 def register_routes():
-    async def sesso_form(request, datasette):
-        db, db_name = await _choose_db(datasette, request)
-        fields = await _meta_fields(db)
+    async def table_form(request, datasette):
+        db, db_name, table, schema = await _resolve(datasette, request)
+        if schema is None:
+            return _not_registered(table)
 
-        fk_options = {}
-        for f in fields:
-            if f["ui_widget"] in ("select", "fk", "lookup"):
-                opts = await _fk_options_for_column(db, "sesso", f["name"], f.get("options_json"))
-                if opts is not None:
-                    fk_options[f["name"]] = opts
+        # FK pickers load their options incrementally from .../<table>/lookup/<column>
+        fk_lookup = {name: _form_url(table, f"lookup/{quote(name, safe='')}") for name in schema["fk"]}
 
         html = await datasette.render_template(
             "sesso.html",
             {
-                "fields": fields,
-                "fk_options": fk_options,
+                "table": table,
+                "fields": schema["fields"],
+                "fk_lookup": fk_lookup,
+                "insert_url": _form_url(table, "insert"),
                 "db_name": db_name,
-                "version": "1.12",
+                "version": "1.14",
             },
             request=request,
         )
         return Response.html(html)
 
-    async def sesso_insert(request, datasette):
-        db, db_name = await _choose_db(datasette, request)
+    async def table_insert(request, datasette):
+        db, db_name, table, schema = await _resolve(datasette, request)
+        if schema is None:
+            return _not_registered(table)
         if request.method != "POST":
             return Response.json({"ok": False, "error": "POST required"}, status=405)
 
         form = await request.post_vars()
-        fields = await _meta_fields(db)
-        allowed = {f["name"] for f in fields}
+        allowed = schema["columns"]
 
         items = []
         for k, v in (form or {}).items():
@@ -229,23 +584,105 @@ def register_routes():
         if not items:
             if _wants_json(request):
                 return Response.json({"ok": False, "error": "No data submitted"}, status=400)
-            return Response.redirect("/sesso?err=1", status=303)
+            form_url = "/sesso" if table == "sesso" else _form_url(table, "form")
+            return Response.redirect(f"{form_url}?err=1", status=303)
 
-        columns = ", ".join([k for k, _ in items])
+        columns = ", ".join([_qid(k) for k, _ in items])
         placeholders = ", ".join(["?"] * len(items))
         values = [v for _, v in items]
 
         await db.execute_write(
-            f"insert into sesso ({columns}) values ({placeholders})",
+            f"insert into {_qid(table)} ({columns}) values ({placeholders})",
             values,
         )
 
-        table_url = f"/{db_name}/sesso?_sort_desc=id"
+        table_url = f"/{db_name}/{table}?_sort_desc=id"
         if _wants_json(request):
             return Response.json({"ok": True, "redirect": table_url})
         return Response.redirect(table_url, status=303)
 
+    async def table_lookup(request, datasette):
+        db, db_name, table, schema = await _resolve(datasette, request)
+        if schema is None:
+            return _not_registered(table)
+        column = request.url_vars["column"]
+        fk = schema["fk"].get(column)
+        if not fk:
+            return Response.json({"ok": False, "error": f"{column} is not a lookup column"}, status=404)
+
+        # ?id=... resolves the label of an already selected value
+        if request.args.get("id") not in (None, ""):
+            await LABEL_CACHE.refresh(db, db_name)
+            sid = request.args.get("id")
+            found = await LABEL_CACHE.labels(db, db_name, fk["table"], fk["pk"], fk["label"], [sid])
+            results = [{"id": sid, "label": found[sid]}] if sid in found else []
+            return Response.json({"ok": True, "column": column, "results": results, "more": False})
+
+        q = (request.args.get("q") or "").strip()
+        try:
+            limit = min(max(int(request.args.get("limit") or LOOKUP_LIMIT), 1), LOOKUP_LIMIT_MAX)
+            offset = max(int(request.args.get("offset") or 0), 0)
+        except ValueError:
+            return Response.json({"ok": False, "error": "limit/offset must be integers"}, status=400)
+
+        results, more = await _lookup(db, fk, q, limit, offset)
+        return Response.json({
+            "ok": True,
+            "column": column,
+            "q": q,
+            "offset": offset,
+            "results": results,
+            "more": more,
+        })
+
+    async def table_insert_batch(request, datasette):
+        # Body: JSON array of objects or NDJSON. Send it as application/json,
+        # which Datasette's CSRF protection lets through.
+        db, db_name, table, schema = await _resolve(datasette, request)
+        if schema is None:
+            return _not_registered(table)
+        if request.method != "POST":
+            return Response.json({"ok": False, "error": "POST required"}, status=405)
+
+        try:
+            parsed = _parse_batch(await request.post_body())
+        except ValueError as e:
+            return Response.json({"ok": False, "error": str(e)}, status=400)
+        if not parsed:
+            return Response.json({"ok": False, "error": "No data submitted"}, status=400)
+
+        allowed = schema["columns"]
+        errors = {}
+        valid = []
+        for i, (row, err) in enumerate(parsed):
+            if err is None:
+                try:
+                    valid.append((i, _batch_items(row, allowed)))
+                    continue
+                except ValueError as e:
+                    err = str(e)
+            errors[i] = err
+
+        ids = {}
+        if valid:
+            ids, failed = await db.execute_write_fn(lambda conn: _insert_batch(conn, table, valid))
+            errors.update(failed)
+
+        rows = [
+            {"index": i, "id": ids[i]} if i in ids else {"index": i, "error": errors.get(i)}
+            for i in range(len(parsed))
+        ]
+        return Response.json(
+            {"ok": not errors, "inserted": len(ids), "errors": len(errors), "rows": rows},
+            status=200 if ids or not errors else 400,
+        )
+
+    # The table must be registered in meta_registry_tables, otherwise 404
     return [
-        (r"^/sesso$", sesso_form),
-        (r"^/sesso/insert$", sesso_insert),
+        (r"^/sesso$", _timed_route("form", table_form)),
+        (r"^/sesso/insert$", _timed_route("insert", table_insert)),
+        (r"^/-/sesso-form/(?P<table>[^/]+)/form$", _timed_route("form", table_form)),
+        (r"^/-/sesso-form/(?P<table>[^/]+)/insert_batch$", _timed_route("insert_batch", table_insert_batch)),
+        (r"^/-/sesso-form/(?P<table>[^/]+)/lookup/(?P<column>[^/]+)$", _timed_route("lookup", table_lookup)),
+        (r"^/-/sesso-form/(?P<table>[^/]+)/insert$", _timed_route("insert", table_insert)),
     ]
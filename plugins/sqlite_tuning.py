@@ -0,0 +1,131 @@
+# plugins/sqlite_tuning.py
+# ------------------------------------------------------------
+# Tuning SQLite per i database del progetto:
+#   - all'avvio: journal_mode=WAL (persistente nel file, basta una volta)
+#   - su ogni connessione (prepare_connection): synchronous, cache_size,
+#     mmap_size, temp_store (sono impostazioni per-connessione)
+#
+# Con WAL le letture delle pagine tabellari non si bloccano più durante
+# gli insert dei form (e dei trigger audit), e synchronous=NORMAL evita
+# un fsync per ogni commit.
+#
+# I valori effettivi letti dal database compaiono in /-/plugin-stats
+# sotto info.sqlite_tuning. Configurazione (metadata.json), tutti opzionali:
+#
+#   "plugins": {
+#     "sqlite_tuning": {
+#       "journal_mode": "wal",       // "delete" per tornare al rollback journal
+#       "synchronous": "normal",
+#       "cache_size": -65536,        // negativo = KiB (64 MiB)
+#       "mmap_size": 268435456,      // 256 MiB
+#       "temp_store": "memory"
+#     }
+#   }
+# ------------------------------------------------------------
+
+import os
+import sys
+
+from datasette import hookimpl
+
+_PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGINS_DIR not in sys.path:
+    sys.path.insert(0, _PLUGINS_DIR)
+
+from neo_common.stats import STATS, tracked  # noqa: E402
+
+PLUGIN = "sqlite_tuning"
+
+DEFAULTS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "temp_store": "memory",
+}
+
+# Valori ammessi per i pragma testuali (finiscono dentro l'SQL)
+_CHOICES = {
+    "journal_mode": ("delete", "truncate", "persist", "memory", "wal", "off"),
+    "synchronous": ("off", "normal", "full", "extra"),
+    "temp_store": ("default", "file", "memory"),
+}
+
+_REPORT = {}  # db -> pragma effettivi
+_SETTINGS = {}  # id(datasette) -> impostazioni validate (lette una volta sola)
+
+
+def _settings(datasette) -> dict:
+    cached = _SETTINGS.get(id(datasette))
+    if cached is not None:
+        return cached
+    try:
+        conf = datasette.plugin_config(PLUGIN) or {}
+    except Exception:
+        conf = {}
+    out = dict(DEFAULTS)
+    for key, default in DEFAULTS.items():
+        val = conf.get(key, default)
+        if key in _CHOICES:
+            val = str(val).lower()
+            if val not in _CHOICES[key]:
+                print(f"[sqlite_tuning] valore non valido per {key}: {val!r}, uso {default!r}")
+                val = default
+        else:
+            try:
+                val = int(val)
+            except (TypeError, ValueError):
+                print(f"[sqlite_tuning] valore non valido per {key}: {val!r}, uso {default!r}")
+                val = default
+        out[key] = val
+    _SETTINGS[id(datasette)] = out
+    return out
+
+
+def _skip(database: str) -> bool:
+    return database == "_internal"
+
+
+@hookimpl
+def prepare_connection(conn, database, datasette):
+    if _skip(database):
+        return
+    s = _settings(datasette)
+    conn.execute(f"PRAGMA synchronous = {s['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {s['cache_size']}")
+    conn.execute(f"PRAGMA mmap_size = {s['mmap_size']}")
+    conn.execute(f"PRAGMA temp_store = {s['temp_store']}")
+
+
+def _effective(conn) -> dict:
+    return {
+        key: conn.execute(f"PRAGMA {key}").fetchone()[0]
+        for key in ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store")
+    }
+
+
+@hookimpl
+def startup(datasette):
+    s = _settings(datasette)
+
+    async def inner():
+        for name, db in datasette.databases.items():
+            if _skip(name):
+                continue
+            db = tracked(PLUGIN, db)
+            try:
+                if getattr(db, "is_mutable", True) and not getattr(db, "is_memory", False):
+                    mode = await db.execute_write_fn(
+                        lambda conn: conn.execute(f"PRAGMA journal_mode = {s['journal_mode']}").fetchone()[0],
+                        block=True,
+                    )
+                    if str(mode).lower() != s["journal_mode"]:
+                        print("[sqlite_tuning]", name, ": journal_mode resta", mode)
+                # Lettura da una connessione normale: mostra ciò che prepare_connection ha applicato
+                _REPORT[name] = await db.execute_fn(_effective)
+            except Exception as e:
+                _REPORT[name] = {"error": str(e)}
+                print("[sqlite_tuning] ERROR:", name, e)
+        STATS.info(PLUGIN, {"settings": s, "databases": _REPORT})
+
+    return inner
@@ -0,0 +1,106 @@
+// Mappa luoghi: i punti arrivano da /luoghi_mappa.geojson, solo per l'area
+// visibile (bbox con un margine) e ricaricati quando la mappa si ferma.
+// La cache HTTP del browser manda If-None-Match: se i dati non sono cambiati
+// il server risponde 304 e non ritrasmette nulla.
+// Sotto CLUSTER_UNTIL_ZOOM i punti arrivano già raggruppati dal server
+// (cluster=1): un cerchio con il numero di luoghi, click = zoom sul gruppo.
+// Il livello "Heatmap" (heat=1) colora celle di griglia in base al numero di
+// eventi registrati nei luoghi che contengono.
+(function () {
+  const CLUSTER_UNTIL_ZOOM = 17;
+
+  const el = document.getElementById("map");
+  const status = document.getElementById("map-status");
+  const url = el.getAttribute("data-geojson");
+
+  const map = L.map(el).setView([55.6761, 12.5683], 12);
+  L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+    maxZoom: 19, attribution: "&copy; OpenStreetMap"
+  }).addTo(map);
+
+  const esc = (s) => String(s == null ? "" : s).replace(/[&<>"']/g, (c) => (
+    { "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;" }[c]
+  ));
+
+  function clusterIcon(n) {
+    const size = n < 10 ? 30 : n < 100 ? 38 : n < 1000 ? 46 : 54;
+    return L.divIcon({
+      html: `<span>${n}</span>`,
+      className: "luoghi-cluster",
+      iconSize: [size, size],
+    });
+  }
+
+  const layer = L.geoJSON(null, {
+    pointToLayer: (f, latlng) => (
+      f.properties.cluster ? L.marker(latlng, { icon: clusterIcon(f.properties.count) }) : L.marker(latlng)
+    ),
+    onEachFeature: (f, lyr) => {
+      const p = f.properties;
+      if (p.cluster) {
+        lyr.bindTooltip(`${p.count} luoghi · ${p.events || 0} eventi`);
+        const [w, s, e, n] = f.bbox;
+        lyr.on("click", () => map.fitBounds([[s, w], [n, e]], { maxZoom: CLUSTER_UNTIL_ZOOM, padding: [20, 20] }));
+        return;
+      }
+      const activity = p.events
+        ? `${p.events} eventi · ultimo ${esc(p.last_date || "?")}${p.voto != null ? ` · voto medio ${p.voto}` : ""}<br>`
+        : "";
+      lyr.bindPopup(`<strong>${esc(p.indirizzo)}</strong><br>${activity}
+        <a href="${esc(p.url)}" target="_blank">➡️ Apri in Datasette</a>`);
+    }
+  }).addTo(map);
+
+  const heat = L.layerGroup();
+  L.control.layers(null, { "Luoghi": layer, "Heatmap (eventi)": heat }).addTo(map);
+
+  function drawHeat(data) {
+    heat.clearLayers();
+    const max = data.features.reduce((acc, f) => Math.max(acc, f.properties.weight), 0);
+    for (const f of data.features) {
+      const [w, s, e, n] = f.bbox;
+      const t = Math.sqrt(f.properties.weight / max);
+      L.rectangle([[s, w], [n, e]], {
+        stroke: false, interactive: true,
+        fillColor: `hsl(${Math.round(60 - 60 * t)}, 100%, 50%)`, fillOpacity: 0.25 + 0.5 * t,
+      }).bindTooltip(`${f.properties.weight} eventi in ${f.properties.count} luoghi`).addTo(heat);
+    }
+  }
+
+  async function fetchJSON(params, signal) {
+    const r = await fetch(`${url}?${params}`, { credentials: "same-origin", signal });
+    if (!r.ok) throw new Error(`HTTP ${r.status}`);
+    return r.json();
+  }
+
+  let inflight = null;
+
+  async function load() {
+    if (inflight) inflight.abort();
+    inflight = new AbortController();
+    const params = new URLSearchParams({
+      bbox: map.getBounds().pad(0.25).toBBoxString(),
+      zoom: String(map.getZoom()),
+    });
+    if (map.getZoom() < CLUSTER_UNTIL_ZOOM) params.set("cluster", "1");
+    status.textContent = "caricamento…";
+    try {
+      const [data, heatData] = await Promise.all([
+        map.hasLayer(layer) ? fetchJSON(params, inflight.signal) : null,
+        map.hasLayer(heat) ? fetchJSON(new URLSearchParams({ bbox: params.get("bbox"), zoom: params.get("zoom"), heat: "1" }), inflight.signal) : null,
+      ]);
+      if (heatData) drawHeat(heatData);
+      if (!data) { status.textContent = ""; return; }
+      layer.clearLayers();
+      layer.addData(data);
+      const n = data.features.reduce((acc, f) => acc + (f.properties.count || 1), 0);
+      status.textContent = `${n} luoghi`;
+    } catch (e) {
+      if (e.name !== "AbortError") status.textContent = `errore: ${e.message}`;
+    }
+  }
+
+  map.on("moveend", load);
+  map.on("overlayadd", load);
+  load();
+})();
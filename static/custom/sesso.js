@@ -1,4 +1,4 @@
-/* neo-datasette v1.9 */
+/* neo-datasette v1.13 */
 (function () {
   function pad(n) { return String(n).padStart(2, "0"); }
 
@@ -21,6 +21,115 @@
     });
   }
 
+  // —— FK typeahead: /-/sesso-form/<tabella>/lookup/<colonna>?q=...&limit=20&offset=N ——
+  const LOOKUP_LIMIT = 20;
+
+  function initPicker(box) {
+    const url = box.getAttribute("data-lookup");
+    const hidden = box.querySelector("input[type=hidden]");
+    const input = box.querySelector(".fk-search");
+    const list = box.querySelector(".fk-results");
+    let q = "", offset = 0, more = false, loading = false, seq = 0, timer = null, active = -1;
+
+    function close() { list.hidden = true; active = -1; }
+
+    function choose(li) {
+      hidden.value = li.dataset.id;
+      input.value = li.textContent;
+      close();
+    }
+
+    function highlight(i) {
+      const items = list.querySelectorAll("li[data-id]");
+      if (!items.length) return;
+      active = Math.max(0, Math.min(i, items.length - 1));
+      items.forEach((li, n) => li.classList.toggle("active", n === active));
+      items[active].scrollIntoView({ block: "nearest" });
+    }
+
+    async function load(reset) {
+      if (reset) { offset = 0; more = false; }
+      const my = ++seq;
+      loading = true;
+      const params = new URLSearchParams({ q, limit: LOOKUP_LIMIT, offset });
+      let data = null;
+      try {
+        const res = await fetch(`${url}?${params}`, { headers: { accept: "application/json" } });
+        data = await res.json();
+      } catch (e) {}
+      if (my !== seq) return;  // risposta superata da una digitazione più recente
+      loading = false;
+      if (!data || !data.ok) return;
+
+      if (reset) { list.innerHTML = ""; active = -1; }
+      const tail = list.querySelector("li.more");
+      if (tail) tail.remove();
+      data.results.forEach((r) => {
+        const li = document.createElement("li");
+        li.dataset.id = r.id;
+        li.textContent = r.label == null ? String(r.id) : String(r.label);
+        list.appendChild(li);
+      });
+      more = data.more;
+      offset += data.results.length;
+      if (more) {
+        const li = document.createElement("li");
+        li.className = "more";
+        li.textContent = "…";
+        list.appendChild(li);
+      }
+      list.hidden = !list.children.length;
+    }
+
+    input.addEventListener("input", () => {
+      hidden.value = "";  // testo modificato: la scelta precedente non vale più
+      q = input.value.trim();
+      clearTimeout(timer);
+      timer = setTimeout(() => load(true), 150);
+    });
+
+    input.addEventListener("focus", () => {
+      if (!list.children.length) load(true);
+      else list.hidden = false;
+    });
+
+    input.addEventListener("keydown", (ev) => {
+      if (list.hidden) return;
+      if (ev.key === "ArrowDown") { ev.preventDefault(); highlight(active + 1); }
+      else if (ev.key === "ArrowUp") { ev.preventDefault(); highlight(active - 1); }
+      else if (ev.key === "Escape") { close(); }
+      else if (ev.key === "Enter") {
+        const li = list.querySelectorAll("li[data-id]")[active];
+        if (li) { ev.preventDefault(); choose(li); }
+      }
+    });
+
+    // Caricamento incrementale: la pagina successiva arriva quando si scorre in fondo
+    list.addEventListener("scroll", () => {
+      if (more && !loading && list.scrollTop + list.clientHeight >= list.scrollHeight - 40) load(false);
+    });
+
+    // mousedown (non click) per scegliere prima del blur dell'input
+    list.addEventListener("mousedown", (ev) => {
+      const li = ev.target.closest("li[data-id]");
+      ev.preventDefault();
+      if (li) choose(li);
+    });
+
+    input.addEventListener("blur", () => {
+      close();
+      if (!hidden.value) input.value = "";
+    });
+
+    // Valore già presente (es. ritorno con il tasto indietro): recupera la label
+    if (hidden.value) {
+      fetch(`${url}?id=${encodeURIComponent(hidden.value)}`, { headers: { accept: "application/json" } })
+        .then((res) => res.json())
+        .then((data) => { if (data.ok && data.results.length) input.value = data.results[0].label; })
+        .catch(() => {});
+    }
+  }
+
   async function submitForm(form) {
     const msg = document.getElementById("msg");
     msg.textContent = "Salvataggio…";
@@ -42,6 +151,7 @@
 
   document.addEventListener("DOMContentLoaded", () => {
     setDefaults();
+    document.querySelectorAll(".fk-picker[data-lookup]").forEach(initPicker);
 
     const form = document.getElementById("sessoForm");
     if (!form) return;